@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Cold-start latency of the sd-generate entry points
+
+Runs each entry point (help, preset listing, argument validation, the
+daemon client, the cloud CLI) in a fresh interpreter and reports the median
+wall time. With -X importtime it also checks that none of them imports a
+heavy module (torch, diffusers, psutil, huggingface_hub), and exits 1 if one
+does or if a baseline shows a slowdown.
+
+Usage:
+    python bench_startup.py
+    python bench_startup.py --repeat 10 --save-baseline startup.json
+    python bench_startup.py --baseline startup.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+GENERATE = str(HERE / "generate.py")
+GENERATE_CLOUD = str(HERE / "generate-cloud.py")
+
+# Modules the light entry points must not import
+HEAVY_MODULES = ("torch", "diffusers", "transformers", "psutil", "huggingface_hub")
+
+def entry_points(socket_path: str):
+    """(name, argv, expected exit code, extra environment, must stay light)"""
+    return [
+        ("python", ["-c", "pass"], 0, {}, True),
+        ("generate --help", [GENERATE, "--help"], 0, {}, True),
+        ("generate --list-presets", [GENERATE, "--list-presets"], 0, {}, True),
+        ("generate invalid args", [GENERATE, "a cat", "--n", "0"], 1, {}, True),
+        ("generate daemon client", [GENERATE, "a cat", "--socket", socket_path], 0, {}, True),
+        ("generate-cloud --help", [GENERATE_CLOUD, "--help"], 0, {}, True),
+        ("generate-cloud no token", [GENERATE_CLOUD, "a cat"], 1, {"HF_TOKEN": ""}, True),
+        # Reference point: what the lazy imports avoid
+        ("import torch", ["-c", "import torch"], 0, {}, False),
+    ]
+
+def stub_daemon(socket_path: str):
+    """Answer every daemon request with exit code 0, so only the client is timed"""
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(8)
+
+    def serve():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn:
+                buffer = b""
+                while not buffer.endswith(b"\n"):
+                    chunk = conn.recv(65536)
+                    if not chunk:
+                        break
+                    buffer += chunk
+                conn.sendall(b'{"type": "result", "exit_code": 0}\n')
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server
+
+def run_once(argv, env, importtime: bool = False):
+    """Wall time of one fresh interpreter, plus the heavy modules it imported"""
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + argv
+    start = time.perf_counter()
+    result = subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+
+    heavy = set()
+    if importtime:
+        for line in result.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                module = line.rsplit("|", 1)[1].strip().split(".")[0]
+                if module in HEAVY_MODULES:
+                    heavy.add(module)
+    return elapsed, result.returncode, sorted(heavy)
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start latency of the sd-generate entry points")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per entry point, median kept (default: 5)")
+    parser.add_argument("--output", type=str, help="Write results JSON here (default: stdout)")
+    parser.add_argument("--save-baseline", type=str, help="Also write results as a baseline file")
+    parser.add_argument("--baseline", type=str, help="Compare against this baseline and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Relative slowdown that counts as a regression (default: 0.25)")
+    parser.add_argument("--min-time-delta", type=float, default=0.05,
+                        help="Ignore slowdowns smaller than this many seconds (default: 0.05)")
+    args = parser.parse_args()
+
+    if args.baseline and not Path(args.baseline).exists():
+        print(f"Error: baseline not found: {args.baseline}", file=sys.stderr)
+        return 1
+
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count()
+        },
+        "repeat": args.repeat,
+        "entry_points": {}
+    }
+    status = 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "daemon.sock")
+        server = stub_daemon(socket_path)
+        try:
+            for name, argv, expected_code, extra_env, light in entry_points(socket_path):
+                env = dict(os.environ, **extra_env)
+                # The first run warms the OS file cache and records the imports
+                _, code, heavy = run_once(argv, env, importtime=True)
+                times = [run_once(argv, env)[0] for _ in range(args.repeat)]
+
+                entry = {
+                    "median": statistics.median(times),
+                    "min": min(times),
+                    "exit_code": code,
+                    "heavy_imports": heavy
+                }
+                results["entry_points"][name] = entry
+                print(f"⏱️  {name:<26} {entry['median'] * 1000:7.1f}ms"
+                      + (f"  (imports {', '.join(heavy)})" if heavy else ""), file=sys.stderr)
+
+                if code != expected_code:
+                    print(f"   ✗ exit code {code}, expected {expected_code}", file=sys.stderr)
+                    status = 1
+                if light and heavy:
+                    print(f"   ✗ should not import {', '.join(heavy)}", file=sys.stderr)
+                    status = 1
+        finally:
+            server.close()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name, entry in results["entry_points"].items():
+            base = baseline.get("entry_points", {}).get(name)
+            if base is None:
+                continue
+            if (entry["median"] - base["median"] > args.min_time_delta
+                    and entry["median"] > base["median"] * (1 + args.threshold)):
+                regressions.append({"entry_point": name, "baseline": base["median"], "value": entry["median"]})
+        results["baseline"] = args.baseline
+        results["regressions"] = regressions
+        if regressions:
+            print(f"\n✗ {len(regressions)} regression(s) against {args.baseline}:", file=sys.stderr)
+            for r in regressions:
+                print(f"   {r['entry_point']}: {r['baseline'] * 1000:.1f}ms → {r['value'] * 1000:.1f}ms",
+                      file=sys.stderr)
+            status = 1
+        else:
+            print(f"\n✓ No regressions against {args.baseline}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(output + "\n")
+        print(f"✓ Baseline saved: {args.save_baseline}", file=sys.stderr)
+
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Benchmark tiled parallel upscaling against a single PIL LANCZOS resize
+
+Usage:
+    python bench_upscale.py                      # 4x 1024px, 4 images
+    python bench_upscale.py --size 512 --scale 2 --n 8
+    python bench_upscale.py --image output.png   # use a real image
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# Load generate.py as a module (the file name has no package around it)
+spec = importlib.util.spec_from_file_location("generate", Path(__file__).with_name("generate.py"))
+generate = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(generate)
+
+
+def test_images(size: int, n: int, image_path: str = None):
+    """Real image if given, otherwise smooth gradients with noise (like generated art)"""
+    if image_path:
+        image = Image.open(image_path).convert("RGB")
+        return [image.copy() for _ in range(n)]
+    
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:size, 0:size] / size
+    images = []
+    for i in range(n):
+        base = np.stack([x, y, (x + y + i / n) % 1.0], axis=-1) * 200
+        noise = rng.normal(0, 20, (size, size, 3))
+        images.append(Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)))
+    return images
+
+
+def timed(fn, repeat: int):
+    """Best wall time over repeat runs, plus the last result"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tiled upscaling vs PIL LANCZOS")
+    parser.add_argument("--size", type=int, default=1024, help="Source edge in pixels (default: 1024)")
+    parser.add_argument("--scale", type=int, default=4, choices=[2, 4], help="Upscale factor (default: 4)")
+    parser.add_argument("--n", type=int, default=4, help="Number of images (default: 4)")
+    parser.add_argument("--tile-size", type=int, default=generate.UPSCALE_TILE_SIZE, help="Source tile edge")
+    parser.add_argument("--workers", type=int, default=None, help="Threads (default: CPU count)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per method, best time kept")
+    parser.add_argument("--image", type=str, default=None, help="Benchmark a real image instead")
+    args = parser.parse_args()
+    
+    images = test_images(args.size, args.n, args.image)
+    width, height = images[0].size
+    print(f"Upscaling {args.n} x {width}x{height} by {args.scale}x "
+          f"({args.workers or os.cpu_count()} threads, {args.tile_size}px tiles)")
+    
+    def pil_path():
+        return [image.resize((image.width * args.scale, image.height * args.scale), Image.LANCZOS)
+                for image in images]
+    
+    def tiled_path():
+        return generate.tiled_upscale(images, args.scale, args.tile_size, args.workers)
+    
+    pil_time, reference = timed(pil_path, args.repeat)
+    tiled_time, tiled = timed(tiled_path, args.repeat)
+    
+    print(f"\n  PIL LANCZOS:   {pil_time:.3f}s ({args.n / pil_time:.2f} images/s)")
+    print(f"  Tiled LANCZOS: {tiled_time:.3f}s ({args.n / tiled_time:.2f} images/s)")
+    print(f"  Speedup:       {pil_time / tiled_time:.2f}x")
+    
+    # Visual equivalence: worst pixel difference and PSNR over all images
+    max_diff = 0
+    mse = 0.0
+    for a, b in zip(reference, tiled):
+        diff = np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16)
+        max_diff = max(max_diff, int(np.abs(diff).max()))
+        mse += float(np.mean(diff.astype(np.float64) ** 2)) / len(reference)
+    psnr = float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+    
+    print(f"\n  Max pixel difference: {max_diff}")
+    print(f"  PSNR: {psnr:.1f} dB")
+    if max_diff == 0:
+        print("  ✓ Output is identical to the PIL path")
+    else:
+        print("  ⚠️  Output differs from the PIL path")
+    
+    return 0 if max_diff == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""Offline benchmark of every quality preset on tiny random pipelines
+
+Each QUALITY_PRESETS entry runs through the same stages as generate.py
+(import, load, LoRA, generate, refine, upscale, save), but against tiny
+randomly-initialized models with the preset's architectures (SD 1.5, SDXL,
+SD 3.5). Nothing is downloaded and everything runs on the CPU, so timings
+are comparable between commits on the same machine. --controlnet adds a
+"<preset>+controlnet" run of each SD 1.5 preset with a depth ControlNet.
+
+Usage:
+    python benchmark.py                                  # all presets, JSON to stdout
+    python benchmark.py --output results.json
+    python benchmark.py --save-baseline baseline.json    # record a baseline
+    python benchmark.py --baseline baseline.json         # fail on regressions
+    python benchmark.py --presets fast ultra --repeat 3
+    python benchmark.py --controlnet                     # also time ControlNet (SD 1.5)
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+
+import psutil
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+DEFAULT_FIXTURES = Path.home() / ".cache" / "sd-generate" / "benchmark-fixtures"
+FIXTURES_VERSION = 1
+
+# Fixture directory per model family. Names keep the substrings generate.py
+# detects families by ("xl", "3.5").
+BASE_FIXTURES = {"sd15": "tiny-sd15", "sdxl": "tiny-sdxl-base", "sd3": "tiny-sd3.5"}
+REFINER_FIXTURES = {"sd15": "tiny-sd15-refiner", "sdxl": "tiny-sdxl-refiner"}
+# Pipeline class load_base_pipeline resolves per family (imported in the "import" stage)
+PIPELINE_CLASSES = {"sd15": "StableDiffusionPipeline", "sdxl": "StableDiffusionXLPipeline",
+                    "sd3": "StableDiffusion3Pipeline"}
+CONTROLNET_SUFFIX = "+controlnet"
+
+def load_generate():
+    """Import generate.py as a module"""
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location("generate", SCRIPT_DIR / "generate.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["generate"] = module
+    spec.loader.exec_module(module)
+    return module
+
+def model_family(model_name: str, use_sd3: bool = False) -> str:
+    """Same detection as ImageGenerator.load_base_pipeline"""
+    if use_sd3 or "3.5" in model_name or "3-5" in model_name:
+        return "sd3"
+    return "sdxl" if "xl" in model_name.lower() else "sd15"
+
+# Fixtures
+
+def build_fixtures(root: Path):
+    """Create tiny random pipelines for every architecture the presets use"""
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import (CLIPTextConfig, CLIPTextModel, CLIPTextModelWithProjection, CLIPTokenizer,
+                              T5Config, T5EncoderModel, T5TokenizerFast)
+    from diffusers import (AutoencoderKL, ControlNetModel, DDIMScheduler, EulerDiscreteScheduler,
+                           FlowMatchEulerDiscreteScheduler, SD3Transformer2DModel, StableDiffusion3Pipeline,
+                           StableDiffusionPipeline, StableDiffusionXLImg2ImgPipeline, StableDiffusionXLPipeline,
+                           UNet2DConditionModel)
+
+    torch.manual_seed(0)
+    root.mkdir(parents=True, exist_ok=True)
+
+    # Character-level CLIP tokenizer
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1}
+    for char in "abcdefghijklmnopqrstuvwxyz,.":
+        vocab[char] = len(vocab)
+        vocab[char + "</w>"] = len(vocab)
+    tokenizer_dir = root / "clip-tokenizer"
+    tokenizer_dir.mkdir(exist_ok=True)
+    (tokenizer_dir / "vocab.json").write_text(json.dumps(vocab))
+    (tokenizer_dir / "merges.txt").write_text("#version: 0.2\n")
+
+    def clip_tokenizer():
+        return CLIPTokenizer(str(tokenizer_dir / "vocab.json"), str(tokenizer_dir / "merges.txt"),
+                             model_max_length=77)
+
+    def clip_text_encoder(with_projection=False):
+        config = CLIPTextConfig(bos_token_id=0, eos_token_id=1, pad_token_id=1, vocab_size=100, hidden_size=32,
+                                intermediate_size=37, num_attention_heads=4, num_hidden_layers=2,
+                                projection_dim=32, layer_norm_eps=1e-05)
+        return (CLIPTextModelWithProjection if with_projection else CLIPTextModel)(config)
+
+    def vae(**kwargs):
+        return AutoencoderKL(block_out_channels=[8, 16], in_channels=3, out_channels=3, latent_channels=4,
+                             down_block_types=["DownEncoderBlock2D"] * 2, up_block_types=["UpDecoderBlock2D"] * 2,
+                             norm_num_groups=8, sample_size=32, **kwargs)
+
+    def unet(**kwargs):
+        return UNet2DConditionModel(block_out_channels=(16, 32), layers_per_block=1, sample_size=32,
+                                    in_channels=4, out_channels=4, norm_num_groups=8,
+                                    down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+                                    up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"), **kwargs)
+
+    def sdxl_unet(cross_attention_dim, add_embedding_dim):
+        return unet(attention_head_dim=(2, 4), use_linear_projection=True, addition_embed_type="text_time",
+                    addition_time_embed_dim=8, transformer_layers_per_block=(1, 2),
+                    projection_class_embeddings_input_dim=add_embedding_dim,
+                    cross_attention_dim=cross_attention_dim)
+
+    # SD 1.5 base, refiner, ControlNet and LoRA
+    sd15 = StableDiffusionPipeline(vae=vae(), text_encoder=clip_text_encoder(), tokenizer=clip_tokenizer(),
+                                   unet=unet(cross_attention_dim=32, attention_head_dim=4),
+                                   scheduler=DDIMScheduler(), safety_checker=None, feature_extractor=None,
+                                   requires_safety_checker=False)
+    sd15.save_pretrained(root / BASE_FIXTURES["sd15"])
+    sd15.save_pretrained(root / REFINER_FIXTURES["sd15"])
+
+    controlnet = ControlNetModel.from_unet(sd15.unet, conditioning_embedding_out_channels=(16, 32))
+    controlnet.save_pretrained(root / "tiny-controlnet")
+
+    from peft import LoraConfig
+    from peft.utils import get_peft_model_state_dict
+    sd15.unet.add_adapter(LoraConfig(r=4, lora_alpha=4, target_modules=["to_q", "to_k", "to_v", "to_out.0"]))
+    StableDiffusionPipeline.save_lora_weights(root / "tiny-lora",
+                                              unet_lora_layers=get_peft_model_state_dict(sd15.unet))
+
+    # SDXL base and refiner (refiner: second text encoder only, aesthetic score embeddings)
+    sdxl = StableDiffusionXLPipeline(vae=vae(), text_encoder=clip_text_encoder(),
+                                     text_encoder_2=clip_text_encoder(with_projection=True),
+                                     tokenizer=clip_tokenizer(), tokenizer_2=clip_tokenizer(),
+                                     unet=sdxl_unet(64, 32 + 8 * 6), scheduler=EulerDiscreteScheduler())
+    sdxl.save_pretrained(root / BASE_FIXTURES["sdxl"])
+
+    refiner = StableDiffusionXLImg2ImgPipeline(vae=sdxl.vae, text_encoder=None, tokenizer=None,
+                                               text_encoder_2=sdxl.text_encoder_2, tokenizer_2=sdxl.tokenizer_2,
+                                               unet=sdxl_unet(32, 32 + 8 * 5), scheduler=EulerDiscreteScheduler(),
+                                               requires_aesthetics_score=True, force_zeros_for_empty_prompt=False)
+    refiner.save_pretrained(root / REFINER_FIXTURES["sdxl"])
+
+    # SD 3.5: MMDiT transformer, two CLIP encoders and a T5 encoder
+    t5_vocab = [("<pad>", 0.0), ("</s>", 0.0), ("<unk>", 0.0)] + [(c, -1.0) for c in "abcdefghijklmnopqrstuvwxyz,. ▁"]
+    t5_tokenizer = Tokenizer(models.Unigram(t5_vocab, unk_id=2))
+    t5_tokenizer.pre_tokenizer = pre_tokenizers.Metaspace()
+    sd3 = StableDiffusion3Pipeline(
+        transformer=SD3Transformer2DModel(sample_size=32, patch_size=1, in_channels=4, out_channels=4, num_layers=1,
+                                          attention_head_dim=8, num_attention_heads=4, caption_projection_dim=32,
+                                          joint_attention_dim=32, pooled_projection_dim=64),
+        scheduler=FlowMatchEulerDiscreteScheduler(),
+        vae=vae(use_quant_conv=False, use_post_quant_conv=False, shift_factor=0.0609, scaling_factor=1.5035),
+        text_encoder=clip_text_encoder(with_projection=True), tokenizer=clip_tokenizer(),
+        text_encoder_2=clip_text_encoder(with_projection=True), tokenizer_2=clip_tokenizer(),
+        text_encoder_3=T5EncoderModel(T5Config(vocab_size=40, d_model=32, d_kv=8, d_ff=37, num_layers=2,
+                                               num_heads=4, pad_token_id=0, eos_token_id=1)),
+        tokenizer_3=T5TokenizerFast(tokenizer_object=t5_tokenizer, eos_token="</s>", pad_token="<pad>",
+                                    unk_token="<unk>", extra_ids=0, model_max_length=77)
+    )
+    sd3.save_pretrained(root / BASE_FIXTURES["sd3"])
+
+    # Control image for the ControlNet stage (depth maps need no preprocessing)
+    from PIL import Image
+    Image.radial_gradient("L").convert("RGB").resize((64, 64)).save(root / "control.png")
+
+    (root / "fixtures.json").write_text(json.dumps({"version": FIXTURES_VERSION}))
+
+def ensure_fixtures(root: Path):
+    """Build the fixtures unless an up-to-date set exists"""
+    try:
+        if json.loads((root / "fixtures.json").read_text())["version"] == FIXTURES_VERSION:
+            return
+    except (OSError, ValueError, KeyError):
+        pass
+    print(f"Building tiny benchmark pipelines in {root}...", file=sys.stderr)
+    build_fixtures(root)
+
+# Measurement
+
+class PeakMemory:
+    """Sample process RSS in the background and keep the peak"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start_rss = self.process.memory_info().rss
+        self.peak = self.start_rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+def import_libraries(family: str):
+    """Import what load_base_pipeline pulls in lazily (torch, diffusers, transformers)"""
+    import diffusers
+    # diffusers exports are lazy: resolving them imports the pipeline modules and their transformers models
+    for name in ("DiffusionPipeline", PIPELINE_CLASSES[family]):
+        getattr(diffusers, name)
+
+def run_preset(generate, preset_name: str, n: int, controlnet: bool = False):
+    """Run one preset's stages once, returning per-stage latency and peak memory"""
+    preset = generate.QUALITY_PRESETS[preset_name]
+    family = model_family(preset["model"], preset.get("use_sd3", False))
+
+    argv = ["a lighthouse on a cliff, oil painting",
+            "--model", BASE_FIXTURES[family], "--n", str(n), "--device", "cpu", "--no-embedding-cache"]
+    if preset["refiner"]:
+        argv += ["--refiner", REFINER_FIXTURES[model_family(preset["refiner"])]]
+    if preset.get("lora"):
+        argv += ["--lora", "tiny-lora"]
+    if controlnet:
+        argv += ["--depth", "control.png"]
+
+    args = generate.build_parser().parse_args(argv)
+    args.quality = preset_name  # Set directly: --quality doesn't offer the SD 3.5 presets
+    generate.prepare_args(args, argv)
+    generator = generate.ImageGenerator(args)
+    output_dir = Path(tempfile.mkdtemp(prefix="sd-generate-bench-"))
+    args.output = str(output_dir)
+
+    stages = {}
+
+    def stage(name, fn, *fn_args):
+        start = time.perf_counter()
+        with PeakMemory() as memory:
+            result = fn(*fn_args)
+        stages[name] = {
+            "time": time.perf_counter() - start,
+            "peak_rss_gb": memory.peak / (1024**3),
+            "peak_delta_gb": (memory.peak - memory.start_rss) / (1024**3)
+        }
+        return result
+
+    # Timed apart from "load" so the first-run import cost doesn't hide loading regressions
+    stage("import", import_libraries, family)
+    stage("load", generator.load_base_pipeline)
+    if args.lora:
+        stage("lora", generator.apply_lora)
+    control_image = stage("controlnet", generator.setup_controlnet) if args.depth else None
+    images = stage("generate", generator.generate_images, control_image)
+    if args.refiner:
+        images = stage("refine", generator.refine_images, images)
+    if args.upscale:
+        images = stage("upscale", generator.upscale_images, images)
+    stage("save", lambda: [generator.save_image(image, i, 0.0) for i, image in enumerate(images, 1)])
+
+    for path in output_dir.iterdir():
+        path.unlink()
+    output_dir.rmdir()
+
+    if generator.metadata["failures"]:
+        raise RuntimeError(f"{preset_name}: {generator.metadata['failures'][-1]['error']}")
+
+    return {
+        "family": family,
+        "steps": args.steps,
+        "resolution": generator.metadata.get("resolution"),
+        "stages": stages
+    }
+
+def run_worker(name: str, fixtures: Path, n: int, threads: int):
+    """Child process entry point: run one preset (or its +controlnet variant) and print its JSON result"""
+    preset_name = name.removesuffix(CONTROLNET_SUFFIX)
+    os.chdir(fixtures)  # Relative fixture paths, so the family detection only sees fixture names
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+
+    with redirect_stdout(sys.stderr):
+        generate = load_generate()
+        generate.CONTROLNET_MODELS["depth"] = "tiny-controlnet"
+        result = run_preset(generate, preset_name, n, controlnet=name != preset_name)
+    print(json.dumps(result))
+    return 0
+
+def benchmark_preset(preset_name: str, args):
+    """Run a preset in fresh processes (so memory peaks don't leak between presets)"""
+    runs = []
+    for _ in range(args.repeat):
+        command = [sys.executable, str(Path(__file__).resolve()), "--worker", preset_name,
+                   "--fixtures", str(args.fixtures), "--n", str(args.n), "--threads", str(args.threads)]
+        process = subprocess.run(command, stdout=subprocess.PIPE,
+                                 stderr=None if args.verbose else subprocess.DEVNULL, text=True)
+        if process.returncode != 0:
+            raise RuntimeError(f"preset {preset_name} failed (exit code {process.returncode}, rerun with --verbose)")
+        runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    # Median over repeats, per stage
+    result = dict(runs[0])
+    result["stages"] = {
+        name: {metric: statistics.median(run["stages"][name][metric] for run in runs)
+               for metric in runs[0]["stages"][name]}
+        for name in runs[0]["stages"]
+    }
+    result["total_time"] = sum(stage["time"] for stage in result["stages"].values())
+    return result
+
+# Baseline comparison
+
+def compare(results, baseline, time_threshold: float, memory_threshold: float, min_time_delta: float,
+            min_memory_delta_gb: float):
+    """Regressions of results against a baseline
+
+    A stage regresses when it is both more than the relative threshold and
+    more than the absolute minimum worse, so tiny stages don't flag noise.
+    """
+    regressions = []
+    for preset_name, result in results["presets"].items():
+        base_preset = baseline.get("presets", {}).get(preset_name)
+        if base_preset is None:
+            continue
+        for stage_name, stage in result["stages"].items():
+            base = base_preset["stages"].get(stage_name)
+            if base is None:
+                continue
+            checks = [
+                ("time", stage["time"], base["time"], time_threshold, min_time_delta, "s"),
+                ("peak_delta_gb", stage["peak_delta_gb"], base["peak_delta_gb"], memory_threshold,
+                 min_memory_delta_gb, "GB")
+            ]
+            for metric, value, base_value, threshold, min_delta, unit in checks:
+                if value - base_value > min_delta and value > base_value * (1 + threshold):
+                    regressions.append({
+                        "preset": preset_name,
+                        "stage": stage_name,
+                        "metric": metric,
+                        "baseline": base_value,
+                        "value": value,
+                        "change": (value / base_value - 1) if base_value > 0 else None,
+                        "unit": unit
+                    })
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline per-stage benchmark of the quality presets")
+    parser.add_argument("--presets", nargs="+", help="Presets to run (default: all)")
+    parser.add_argument("--n", type=int, default=1, help="Images per preset (default: 1)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per preset, median kept (default: 1)")
+    parser.add_argument("--threads", type=int, default=0, help="CPU threads (default: PyTorch's choice)")
+    parser.add_argument("--fixtures", type=Path, default=DEFAULT_FIXTURES,
+                        help=f"Tiny pipeline directory (default: {DEFAULT_FIXTURES})")
+    parser.add_argument("--output", type=str, help="Write results JSON here (default: stdout)")
+    parser.add_argument("--save-baseline", type=str, help="Also write results as a baseline file")
+    parser.add_argument("--baseline", type=str, help="Compare against this baseline and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Relative slowdown that counts as a regression (default: 0.25)")
+    parser.add_argument("--memory-threshold", type=float, default=0.25,
+                        help="Relative peak memory growth that counts as a regression (default: 0.25)")
+    parser.add_argument("--min-time-delta", type=float, default=0.05,
+                        help="Ignore slowdowns smaller than this many seconds (default: 0.05)")
+    parser.add_argument("--min-memory-delta", type=float, default=0.05,
+                        help="Ignore memory growth smaller than this many GB (default: 0.05)")
+    parser.add_argument("--controlnet", action="store_true",
+                        help="Also run each SD 1.5 preset with a depth ControlNet (as <preset>+controlnet)")
+    parser.add_argument("--verbose", action="store_true", help="Show generate.py output")
+    parser.add_argument("--worker", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    args.fixtures = args.fixtures.resolve()
+    if args.worker:
+        return run_worker(args.worker, args.fixtures, args.n, args.threads)
+
+    # Preset definitions come from generate.py
+    generate = load_generate()
+    presets = args.presets or list(generate.QUALITY_PRESETS)
+    unknown = [name for name in presets if name not in generate.QUALITY_PRESETS]
+    if unknown:
+        print(f"Error: unknown preset(s): {', '.join(unknown)}", file=sys.stderr)
+        return 1
+
+    if args.baseline and not Path(args.baseline).exists():
+        print(f"Error: baseline not found: {args.baseline}", file=sys.stderr)
+        return 1
+
+    ensure_fixtures(args.fixtures)
+
+    if args.controlnet:  # ControlNet models exist for SD 1.5 only
+        presets += [name + CONTROLNET_SUFFIX for name in presets
+                    if model_family(generate.QUALITY_PRESETS[name]["model"],
+                                    generate.QUALITY_PRESETS[name].get("use_sd3", False)) == "sd15"]
+
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "threads": args.threads or None
+        },
+        "n": args.n,
+        "repeat": args.repeat,
+        "presets": {}
+    }
+
+    for preset_name in presets:
+        print(f"⏱️  {preset_name}...", file=sys.stderr)
+        result = benchmark_preset(preset_name, args)
+        results["presets"][preset_name] = result
+        summary = ", ".join(f"{name} {stage['time']:.2f}s" for name, stage in result["stages"].items())
+        print(f"   {result['total_time']:.2f}s ({summary})", file=sys.stderr)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.memory_threshold,
+                              args.min_time_delta, args.min_memory_delta)
+        results["baseline"] = args.baseline
+        results["regressions"] = regressions
+        if regressions:
+            print(f"\n✗ {len(regressions)} regression(s) against {args.baseline}:", file=sys.stderr)
+            for r in regressions:
+                change = f" (+{r['change'] * 100:.0f}%)" if r["change"] is not None else ""
+                print(f"   {r['preset']} / {r['stage']} {r['metric']}: "
+                      f"{r['baseline']:.3f}{r['unit']} → {r['value']:.3f}{r['unit']}{change}", file=sys.stderr)
+            status = 1
+        else:
+            print(f"\n✓ No regressions against {args.baseline}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(output + "\n")
+        print(f"✓ Baseline saved: {args.save_baseline}", file=sys.stderr)
+
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
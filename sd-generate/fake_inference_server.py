@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""Local stand-in for a text-to-image inference endpoint
+
+Answers POSTs in the Hugging Face Inference API shape ({"inputs": prompt,
+"parameters": {...}}) with a small PNG after a simulated latency. It can
+throttle like a real provider: requests beyond --max-in-flight, or beyond
+--rate-limit per second, get 429 with a Retry-After header, and
+--error-rate of the rest fail with --error-status
+(503 by default). GET /stats reports what it saw.
+
+Usage:
+    python fake_inference_server.py --port 8765 --latency 0.5 --max-in-flight 4
+    python generate-cloud.py "a cat" --n 20 --endpoint http://127.0.0.1:8765
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeInferenceServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the simulation settings and request counters"""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.5, jitter: float = 0.1, max_in_flight: int = 0,
+                 rate_limit: float = 0, error_rate: float = 0, error_status: int = 503, retry_after: float = 1,
+                 size: int = 64):
+        super().__init__(address, RequestHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.max_in_flight = max_in_flight
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.size = size
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.recent = []  # Start times of requests accepted in the last second
+        self.stats = {"requests": 0, "ok": 0, "throttled": 0, "errors": 0, "max_in_flight": 0, "prompts": []}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def admit(self):
+        """Count a request in; returns the HTTP status it should fail with, or None"""
+        with self.lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            self.recent = [t for t in self.recent if now - t < 1.0]
+            if ((self.max_in_flight and self.in_flight >= self.max_in_flight)
+                    or (self.rate_limit and len(self.recent) >= self.rate_limit)):
+                self.stats["throttled"] += 1
+                return 429
+            if random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return self.error_status
+            self.recent.append(now)
+            self.in_flight += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+            return None
+
+    def release(self, prompt: str):
+        with self.lock:
+            self.in_flight -= 1
+            self.stats["ok"] += 1
+            self.stats["prompts"].append(prompt)
+
+    def render(self, payload) -> bytes:
+        """A solid-colour PNG derived from the request, so equal requests give equal images"""
+        from PIL import Image
+
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).digest()
+        image = Image.new("RGB", (self.size, self.size), tuple(digest[:3]))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass  # Keep test output readable
+
+    def send(self, status: int, body: bytes, content_type: str, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self.send(404, b'{"error": "not found"}', "application/json")
+            return
+        with self.server.lock:
+            body = json.dumps(self.server.stats).encode("utf-8")
+        self.send(200, body, "application/json")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            prompt = payload["inputs"]
+        except (ValueError, KeyError):
+            self.send(400, b'{"error": "expected {\\"inputs\\": prompt}"}', "application/json")
+            return
+
+        status = self.server.admit()
+        if status == 429:
+            self.send(429, b'{"error": "rate limited"}', "application/json",
+                      {"Retry-After": f"{self.server.retry_after:g}"})
+            return
+        if status is not None:
+            self.send(status, b'{"error": "simulated failure"}', "application/json")
+            return
+
+        try:
+            time.sleep(max(0.0, self.server.latency + random.uniform(-1, 1) * self.server.jitter))
+            body = self.server.render(payload)
+        finally:
+            self.server.release(prompt)
+        self.send(200, body, "image/png")
+
+def start_server(port: int = 0, **settings) -> FakeInferenceServer:
+    """Serve in a background thread (port 0 = any free port); stop with server.shutdown()"""
+    server = FakeInferenceServer(("127.0.0.1", port), **settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for a text-to-image inference endpoint")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per image (default: 0.5)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Random +/- seconds on the latency (default: 0.1)")
+    parser.add_argument("--max-in-flight", type=int, default=0,
+                        help="Answer 429 beyond this many concurrent requests, 0 = no limit (default: 0)")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="Answer 429 beyond this many requests per second, 0 = no limit (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="Fraction of requests failing with --error-status (default: 0)")
+    parser.add_argument("--error-status", type=int, default=503,
+                        help="HTTP status of simulated failures (default: 503)")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After sent with 429s (default: 1)")
+    args = parser.parse_args()
+
+    server = FakeInferenceServer(("127.0.0.1", args.port), latency=args.latency, jitter=args.jitter,
+                                 max_in_flight=args.max_in_flight, rate_limit=args.rate_limit,
+                                 error_rate=args.error_rate, error_status=args.error_status,
+                                 retry_after=args.retry_after)
+    print(f"Fake inference endpoint on {server.url} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"\n{json.dumps({k: v for k, v in server.stats.items() if k != 'prompts'})}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
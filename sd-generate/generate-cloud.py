@@ -7,11 +7,236 @@ Default mode - uses fal-ai provider for fast cloud generation
 import os
 import sys
 import argparse
+import hashlib
 import json
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
-from huggingface_hub import InferenceClient
+
+# Retries for throttled (429) and failed (5xx) requests: exponential backoff
+# from RETRY_BASE_DELAY seconds, capped at RETRY_MAX_DELAY
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# Response cache: images of earlier identical requests, and its size limit
+RESPONSE_CACHE_DIR = Path.home() / ".cache" / "sd-generate" / "cloud"
+RESPONSE_CACHE_MAX_GB = 2.0
+
+class RateLimiter:
+    """Spaces request starts at least 1/rate seconds apart, across threads"""
+    
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_start = 0.0
+        self.lock = threading.Lock()
+    
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+class ResponseCache:
+    """Content-addressed images of earlier requests, so repeats need no network call
+    
+    Entries are PNG files named by a hash of the model, prompt, negative
+    prompt, seed and provider. The least recently used ones are deleted
+    once the directory grows past max_gb.
+    """
+    
+    def __init__(self, cache_dir: Path = RESPONSE_CACHE_DIR, max_gb: float = RESPONSE_CACHE_MAX_GB):
+        self.cache_dir = Path(cache_dir)
+        self.max_gb = max_gb
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+    
+    @staticmethod
+    def make_key(model: str, prompt: str, negative_prompt, seed: int, provider: str) -> str:
+        """Hash everything that changes the returned image"""
+        payload = json.dumps([model, prompt, negative_prompt, seed, provider])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str):
+        """Path of the cached image for key, or None"""
+        path = self.cache_dir / f"{key}.png"
+        try:
+            os.utime(path)  # Keep recently used entries from being evicted
+        except FileNotFoundError:
+            with self.lock:
+                self.stats["misses"] += 1
+            return None
+        with self.lock:
+            self.stats["hits"] += 1
+        return path
+    
+    def put(self, key: str, image_path: Path):
+        """Copy a freshly saved image into the cache"""
+        import shutil
+        
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            partial = self.cache_dir / f"{key}.{threading.get_ident()}.partial"
+            shutil.copyfile(image_path, partial)
+            os.replace(partial, self.cache_dir / f"{key}.png")  # Never expose a half-written entry
+            with self.lock:
+                self._evict()
+        except OSError as e:
+            print(f"⚠️  Could not write response cache: {e}")
+    
+    def _evict(self):
+        """Delete the least recently used images once the cache is over its limit"""
+        files = []
+        for path in self.cache_dir.glob("*.png"):
+            try:
+                files.append((path.stat().st_mtime, path.stat().st_size, path))
+            except FileNotFoundError:
+                continue  # Evicted by another process
+        files.sort()
+        total_bytes = sum(size for _, size, _ in files)
+        limit_bytes = self.max_gb * (1024**3)
+        while files and total_bytes > limit_bytes:
+            _, size, oldest = files.pop(0)
+            total_bytes -= size
+            oldest.unlink(missing_ok=True)
+            self.stats["evictions"] += 1
+
+class EndpointClient:
+    """text_to_image against a plain HTTP endpoint (Inference Endpoints, self-hosted, test servers)
+    
+    Sends {"inputs": prompt, "parameters": {...}} and expects image bytes back,
+    like the Hugging Face Inference API.
+    """
+    
+    def __init__(self, url: str, api_key=None, timeout: float = 300):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+    
+    def text_to_image(self, prompt: str, model=None, negative_prompt=None, seed=None):
+        import io
+        import urllib.request
+        from PIL import Image
+        
+        parameters = {"negative_prompt": negative_prompt} if negative_prompt else {}
+        if seed is not None:
+            parameters["seed"] = seed
+        body = json.dumps({"inputs": prompt, "model": model, "parameters": parameters}).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Accept": "image/png"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        
+        request = urllib.request.Request(self.url, data=body, headers=headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            image = Image.open(io.BytesIO(response.read()))
+            image.load()
+        return image
+
+def error_status(error):
+    """(HTTP status, Retry-After seconds) of a failed request, None where unknown
+    
+    Covers huggingface_hub errors (error.response) and urllib's HTTPError.
+    """
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "code", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    try:
+        retry_after = float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        retry_after = None
+    return (status if isinstance(status, int) else None), retry_after
+
+def retry_delay(attempt: int, retry_after=None) -> float:
+    """Backoff before retry number attempt (0-based), at least the server's Retry-After"""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.0)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, RETRY_MAX_DELAY))
+    return delay
+
+def request_image(client, args, index: int, seed: int, limiter: RateLimiter):
+    """Request one image, retrying 429 and 5xx responses; returns (image, attempts)"""
+    for attempt in range(args.max_retries + 1):
+        limiter.wait()
+        try:
+            image = client.text_to_image(
+                args.prompt,
+                model=args.model,
+                negative_prompt=args.negative_prompt,
+                seed=seed
+            )
+            return image, attempt + 1
+        except Exception as e:
+            status, retry_after = error_status(e)
+            retryable = status == 429 or (status is not None and 500 <= status < 600)
+            if not retryable or attempt == args.max_retries:
+                raise
+            delay = retry_delay(attempt, retry_after)
+            reason = "throttled" if status == 429 else f"HTTP {status}"
+            print(f"  ↻ [{index}/{args.n}] {reason} - retrying in {delay:.1f}s "
+                  f"({attempt + 1}/{args.max_retries})")
+            time.sleep(delay)
+
+def generate_one(client, args, index: int, limiter: RateLimiter, cache, output_dir: Path, timestamp: str,
+                 start_time: float):
+    """Request image index and save it (with metadata) as soon as it lands
+    
+    Identical earlier requests are served from the response cache instead.
+    """
+    import shutil
+    
+    seed = args.seed + index - 1  # Image i uses seed + i, as in generate
+    provider = args.endpoint or "fal-ai"
+    
+    filename = f"output_{timestamp}_{index:03d}.png"
+    json_filename = f"output_{timestamp}_{index:03d}.json"
+    
+    image_path = output_dir / filename
+    json_path = output_dir / json_filename
+    
+    request_start = time.time()
+    key = cache.make_key(args.model, args.prompt, args.negative_prompt, seed, provider) if cache else None
+    cached_path = cache.get(key) if cache else None
+    if cached_path is not None:
+        shutil.copyfile(cached_path, image_path)
+        attempts = 0
+        request_time = time.time() - request_start
+        print(f"✓ [{index}/{args.n}] Saved: {image_path} (cache hit)")
+    else:
+        image, attempts = request_image(client, args, index, seed, limiter)
+        request_time = time.time() - request_start
+        image.save(image_path)
+        if cache:
+            cache.put(key, image_path)
+        print(f"✓ [{index}/{args.n}] Saved: {image_path} ({request_time:.2f}s"
+              + (f", {attempts} attempts)" if attempts > 1 else ")"))
+    
+    # Save metadata
+    metadata = {
+        "prompt": args.prompt,
+        "negative_prompt": args.negative_prompt,
+        "seed": seed,
+        "model": args.model,
+        "provider": provider,
+        "method": "cloud",
+        "image_index": index,
+        "filename": filename,
+        "generation_time": time.time() - start_time,
+        "request_time": request_time,
+        "attempts": attempts,
+        "concurrency": args.concurrency,
+        "cache": ("hit" if cached_path is not None else "miss") if cache else "disabled"
+    }
+    
+    with open(json_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+    
+    return attempts
 
 def main():
     parser = argparse.ArgumentParser(
@@ -25,85 +250,111 @@ def main():
     parser.add_argument("--n", type=int, default=1, help="Number of images")
     parser.add_argument("--seed", type=int, default=42, help="Random seed")
     parser.add_argument("--negative-prompt", type=str, help="Negative prompt")
+    parser.add_argument("--concurrency", type=int, default=4,
+                       help="Requests in flight at once (default: 4)")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                       help="Max requests started per second, 0 = unlimited (default: 0)")
+    parser.add_argument("--max-retries", type=int, default=5,
+                       help="Retries per image after 429/5xx responses (default: 5)")
+    parser.add_argument("--endpoint", type=str,
+                       help="Send requests to this HTTP endpoint instead of the fal-ai provider")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="Always call the API (skip the local response cache)")
+    parser.add_argument("--cache-max-gb", type=float, default=RESPONSE_CACHE_MAX_GB,
+                       help=f"Size limit of the response cache in GB (default: {RESPONSE_CACHE_MAX_GB:g})")
     
     args = parser.parse_args()
     
-    # Check for API key
+    if args.n < 1:
+        print("Error: --n must be at least 1")
+        return 1
+    if args.concurrency < 1:
+        print("Error: --concurrency must be at least 1")
+        return 1
+    if args.rate_limit < 0 or args.max_retries < 0 or args.cache_max_gb < 0:
+        print("Error: --rate-limit, --max-retries and --cache-max-gb must be 0 or more")
+        return 1
+    
+    # Check for API key (optional for a custom endpoint)
     api_key = os.environ.get("HF_TOKEN")
-    if not api_key:
+    if not api_key and not args.endpoint:
         print("Error: HF_TOKEN environment variable not set")
         print("Get your token from: https://huggingface.co/settings/tokens")
         print("Then run: export HF_TOKEN='your-token-here'")
         return 1
     
     # Create client
-    client = InferenceClient(
-        provider="fal-ai",
-        api_key=api_key
-    )
+    if args.endpoint:
+        client = EndpointClient(args.endpoint, api_key)
+    else:
+        # Imported here so --help and argument errors don't pay for huggingface_hub
+        from huggingface_hub import InferenceClient
+        
+        client = InferenceClient(
+            provider="fal-ai",
+            api_key=api_key
+        )
     
     print(f"Generating {args.n} image(s) with {args.model}...")
     print(f"Prompt: {args.prompt}")
     if args.negative_prompt:
         print(f"Negative: {args.negative_prompt}")
+    concurrency = min(args.concurrency, args.n)
+    print(f"Concurrency: {concurrency}"
+          + (f", rate limit {args.rate_limit:g}/s" if args.rate_limit else ""))
     print()
     
-    # Generate images
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    limiter = RateLimiter(args.rate_limit)
+    cache = None if args.no_cache else ResponseCache(max_gb=args.cache_max_gb)
+    
+    # Generate images - each one is saved by its worker as soon as it lands
     start_time = time.time()
+    saved = 0
+    retries = 0
     
-    for i in range(args.n):
-        try:
-            print(f"[{i+1}/{args.n}] Generating...")
-            
-            # Generate image
-            image = client.text_to_image(
-                args.prompt,
-                model=args.model,
-                negative_prompt=args.negative_prompt
-            )
-            
-            # Save image
-            output_dir = Path(args.output)
-            output_dir.mkdir(parents=True, exist_ok=True)
-            
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            filename = f"output_{timestamp}_{i+1:03d}.png"
-            json_filename = f"output_{timestamp}_{i+1:03d}.json"
-            
-            image_path = output_dir / filename
-            json_path = output_dir / json_filename
-            
-            image.save(image_path)
-            print(f"✓ Saved: {image_path}")
-            
-            # Save metadata
-            metadata = {
-                "prompt": args.prompt,
-                "negative_prompt": args.negative_prompt,
-                "seed": args.seed,
-                "model": args.model,
-                "provider": "fal-ai",
-                "method": "cloud",
-                "image_index": i + 1,
-                "filename": filename,
-                "generation_time": time.time() - start_time
-            }
-            
-            with open(json_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
-                
-        except Exception as e:
-            print(f"✗ Error generating image {i+1}: {e}")
-            continue
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(generate_one, client, args, i + 1, limiter, cache, output_dir, timestamp,
+                            start_time): i + 1
+            for i in range(args.n)
+        }
+        for future in as_completed(futures):
+            try:
+                retries += max(future.result() - 1, 0)
+                saved += 1
+            except Exception as e:
+                print(f"✗ Error generating image {futures[future]}: {e}")
     
     total_time = time.time() - start_time
     print(f"\n{'='*60}")
     print(f"✓ Generation complete!")
-    print(f"  Time: {total_time:.2f}s")
-    print(f"  Images: {args.n}")
+    print(f"  Time: {total_time:.2f}s ({saved / total_time:.2f} images/s)")
+    print(f"  Images: {saved}/{args.n}")
+    if retries:
+        print(f"  Retries: {retries}")
+    if cache:
+        print(f"  Cache: {cache.stats['hits']} hit(s), {cache.stats['misses']} miss(es)"
+              + (f", {cache.stats['evictions']} evicted" if cache.stats['evictions'] else ""))
     print(f"{'='*60}")
     
-    return 0
+    # Run totals, next to the per-image metadata
+    summary = {
+        "timestamp": timestamp,
+        "model": args.model,
+        "provider": args.endpoint or "fal-ai",
+        "images": saved,
+        "requested": args.n,
+        "total_time": total_time,
+        "retries": retries,
+        "cache": dict(cache.stats) if cache else None
+    }
+    with open(output_dir / f"cloud_summary_{timestamp}.json", 'w') as f:
+        json.dump(summary, f, indent=2)
+    
+    return 0 if saved else 1
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -5,23 +5,115 @@ SD-Generate: Robust Text-to-Image Generation with MPS Acceleration
 
 import os
 import sys
-import torch
 import argparse
 import json
 import time
 import gc
-import psutil
+import hashlib
+import importlib.util
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from copy import deepcopy
 from datetime import datetime
 from pathlib import Path
+from collections import OrderedDict, namedtuple
 from typing import Optional, List, Dict, Any
 
-# Force MPS environment
+# Let MPS fall back to the CPU for unsupported ops
 os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
-os.environ["CUDA_VISIBLE_DEVICES"] = ""
-if "CUDA_HOME" in os.environ:
-    del os.environ["CUDA_HOME"]
-if "CUDA_PATH" in os.environ:
-    del os.environ["CUDA_PATH"]
+
+# Devices accepted by --device ("auto" picks CUDA, then MPS, then CPU)
+DEVICE_CHOICES = ["auto", "cpu", "mps", "cuda"]
+
+# ControlNet weights per control mode (SD 1.5)
+CONTROLNET_MODELS = {
+    "pose": "lllyasviel/control_v11p_sd15_openpose",
+    "depth": "lllyasviel/control_v11f1p_sd15_depth",
+    "canny": "lllyasviel/control_v11p_sd15_canny"
+}
+
+# Default base model when neither --model nor a preset picks one
+DEFAULT_MODEL = "Lykon/DreamShaper-8"
+
+# Memory sampler: seconds between samples and points kept in the metadata timeline
+MEMORY_SAMPLE_INTERVAL = 0.1
+MEMORY_TIMELINE_POINTS = 120
+
+# Background image writer: worker threads and images allowed to wait on it
+SAVE_WORKERS = 2
+SAVE_QUEUE_LIMIT = 4
+
+# --compile: inductor's on-disk caches, saved compile artifacts and the
+# per-step timings compiled runs are compared against
+COMPILE_CACHE_DIR = Path.home() / ".cache" / "sd-generate" / "compile"
+STEP_TIMES_PATH = COMPILE_CACHE_DIR / "step_times.json"
+
+# --quantize int8: cached quantized modules and the components quantized
+QUANTIZED_CACHE_DIR = Path.home() / ".cache" / "sd-generate" / "quantized"
+QUANTIZE_COMPONENTS = ("text_encoder", "text_encoder_2", "unet")
+
+# --warm-cache: models re-saved as safetensors in their target dtype, so
+# loads are plain (memory-mapped) reads with no conversion
+SNAPSHOT_DIR = Path.home() / ".cache" / "sd-generate" / "snapshots"
+SNAPSHOT_MARKER = "snapshot.json"
+
+# --fuse-lora: components with a LoRA fused in, keyed by model + LoRA + scale
+FUSED_LORA_DIR = Path.home() / ".cache" / "sd-generate" / "fused-lora"
+FUSED_LORA_MARKER = "fused.json"
+
+# Tile the VAE encode/decode at or above this many pixels on the long edge
+VAE_TILING_THRESHOLD = 1536
+
+# Tiled upscaling: source tile edge in pixels (tiles are resampled in parallel)
+UPSCALE_TILE_SIZE = 256
+
+# Prompt embedding cache: in-memory LRU entries and on-disk size limit
+EMBEDDING_CACHE_DIR = Path.home() / ".cache" / "sd-generate" / "embeddings"
+EMBEDDING_CACHE_ENTRIES = 256
+EMBEDDING_CACHE_MAX_DISK_GB = 2.0
+
+# Unix socket used by the warm-pipeline daemon (generate --serve)
+DAEMON_SOCKET = os.environ.get(
+    "SD_GENERATE_SOCKET",
+    str(Path.home() / ".cache" / "sd-generate" / "daemon.sock")
+)
+
+# Keep the refiner loaded between images unless free memory drops below this
+REFINER_MIN_FREE_GB = 2.0
+
+# SD 3.5 loads in stages (text encoders freed before the transformer loads)
+# when less than this much memory is available (--offload auto)
+SD3_OFFLOAD_BELOW_GB = 30.0
+
+# Pipeline cache evicts least-recently-used entries below this much free memory
+CACHE_MIN_FREE_GB = 4.0
+
+# Approximate denoising working memory per image, per megapixel, by model family
+GENERATE_GB_PER_MEGAPIXEL = {"sd15": 1.5, "sdxl": 2.0, "sd3": 3.0}
+GENERATE_MIN_FREE_GB = 2.0
+
+# Memory planner: half-precision working memory per image, per megapixel, by
+# model family - split into attention, the rest of the denoiser, and VAE decode
+PLAN_ATTENTION_GB_PER_MEGAPIXEL = {"sd15": 1.0, "sdxl": 1.3, "sd3": 2.0}
+PLAN_DENOISE_GB_PER_MEGAPIXEL = {"sd15": 0.3, "sdxl": 0.5, "sd3": 0.8}
+PLAN_VAE_GB_PER_MEGAPIXEL = 1.6
+PLAN_ATTENTION_SLICING_FACTOR = 0.3  # Share of attention memory left with slicing on
+PLAN_FUSED_ATTENTION_FACTOR = 0.1  # Share left with fused SDPA kernels (CPU/CUDA), which slicing only slows down
+PLAN_VAE_TILE_MEGAPIXELS = 0.26  # A 512x512 decode tile
+
+# Memory plans from fastest to most frugal - the planner takes the first that fits
+MEMORY_PLANS = [
+    (),
+    ("attention_slicing",),
+    ("attention_slicing", "vae_slicing"),
+    ("attention_slicing", "vae_slicing", "vae_tiling"),
+    ("attention_slicing", "vae_slicing", "vae_tiling", "model_offload"),
+]
+
+# Approximate img2img refiner working memory per image, per megapixel
+REFINE_GB_PER_MEGAPIXEL = {"sd15": 2.0, "sdxl": 1.5}
 
 # Style presets
 STYLES = {
@@ -148,29 +240,103 @@ QUALITY_PRESETS = {
     }
 }
 
+# Device Backend
+def resolve_device(requested: str = "auto") -> str:
+    """Torch device for --device (auto: CUDA, then MPS, then CPU)"""
+    import torch
+    
+    if requested == "auto":
+        if torch.cuda.is_available():
+            return "cuda"
+        if torch.backends.mps.is_available():
+            return "mps"
+        return "cpu"
+    
+    if requested == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("--device cuda requested but CUDA is not available")
+    if requested == "mps" and not torch.backends.mps.is_available():
+        raise RuntimeError("--device mps requested but MPS is not available")
+    return requested
+
+def cpu_supports_bfloat16() -> bool:
+    """Whether the CPU has native bfloat16 kernels (AVX512-BF16 / AMX)"""
+    import torch
+    
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+def resolve_dtype(device: str, model_family: str):
+    """Weight dtype for a model family on a device
+    
+    MPS keeps SD 1.5/SDXL in float32 (VAE decode issues in half precision).
+    SD 3.5 always runs in bfloat16 - it doesn't fit in memory otherwise.
+    CUDA uses float16, or bfloat16 for SDXL where supported (fp16 VAE
+    overflow). CPU uses bfloat16 when the CPU has native support.
+    """
+    import torch
+    
+    if model_family == "sd3":
+        return torch.bfloat16
+    if device == "cuda":
+        if model_family == "sdxl" and torch.cuda.is_bf16_supported():
+            return torch.bfloat16
+        return torch.float16
+    if device == "cpu" and cpu_supports_bfloat16():
+        return torch.bfloat16
+    return torch.float32
+
+def configure_backend(args) -> str:
+    """Resolve the device and apply process-wide backend settings"""
+    import torch
+    
+    device = resolve_device(getattr(args, "device", "auto") or "auto")
+    
+    if device == "mps":
+        # Keep libraries from picking up a CUDA toolkit next to MPS
+        os.environ["CUDA_VISIBLE_DEVICES"] = ""
+        os.environ.pop("CUDA_HOME", None)
+        os.environ.pop("CUDA_PATH", None)
+    
+    threads = getattr(args, "threads", 0)
+    if threads:
+        torch.set_num_threads(threads)
+    
+    return device
+
+def empty_device_cache():
+    """Release cached allocator memory on whichever accelerators are in use"""
+    import torch
+    
+    if torch.cuda.is_available() and torch.cuda.is_initialized():
+        torch.cuda.empty_cache()
+    if torch.backends.mps.is_available():
+        torch.mps.empty_cache()
+
 # Memory Management Utilities
 def cleanup_memory(aggressive=False):
-    """Clean up memory on MPS device"""
+    """Clean up memory on the CPU and accelerator"""
     try:
         # Collect Python garbage
         gc.collect()
         
-        # Clear MPS cache
-        if torch.backends.mps.is_available():
-            torch.mps.empty_cache()
+        # Clear accelerator cache
+        empty_device_cache()
             
         # Aggressive mode for SD 3.5
         if aggressive:
             gc.collect()
             time.sleep(0.5)  # Give system time to release memory
-            if torch.backends.mps.is_available():
-                torch.mps.empty_cache()
+            empty_device_cache()
                 
     except Exception as e:
         print(f"⚠️  Memory cleanup warning: {e}")
 
 def get_memory_info():
     """Get current memory usage information"""
+    import psutil
+    
     try:
         process = psutil.Process()
         mem_info = process.memory_info()
@@ -186,6 +352,20 @@ def get_memory_info():
     except Exception as e:
         return {"error": str(e)}
 
+def available_memory_gb(device: Optional[str]) -> Optional[float]:
+    """Memory left for a device's models: free VRAM on CUDA, available system RAM elsewhere
+    
+    None when it can't be read.
+    """
+    if device == "cuda":
+        import torch
+        free_bytes, _ = torch.cuda.mem_get_info()
+        return free_bytes / (1024**3)
+    mem_info = get_memory_info()
+    if "error" in mem_info:
+        return None
+    return mem_info["system_available_gb"]
+
 def log_memory_status(label=""):
     """Log current memory status"""
     mem_info = get_memory_info()
@@ -196,20 +376,719 @@ def log_memory_status(label=""):
     else:
         print(f"⚠️  Could not read memory info: {mem_info['error']}")
 
+def accelerator_allocated_gb(device: str) -> float:
+    """Memory currently allocated by torch on the accelerator (0 on CPU)"""
+    import torch
+    
+    try:
+        if device == "cuda" and torch.cuda.is_initialized():
+            return torch.cuda.memory_allocated() / (1024**3)
+        if device == "mps":
+            return torch.mps.current_allocated_memory() / (1024**3)
+    except Exception:
+        pass
+    return 0.0
+
+class MemorySampler:
+    """Sample memory on a background thread and keep per-stage peaks
+    
+    Every sample records process RSS, system available memory and
+    accelerator-allocated memory. Peaks are attributed to every stage active
+    at the time (stages can overlap - saves run on the writer threads).
+    """
+    
+    def __init__(self, device: str, interval: float = MEMORY_SAMPLE_INTERVAL):
+        self.device = device
+        self.interval = interval
+        self.samples = []  # (seconds since start, rss_gb, available_gb, accelerator_gb)
+        self.stage_peaks = {}
+        self.active_stages = {}  # stage -> nesting count
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start = time.perf_counter()
+    
+    def start(self):
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.sample()  # Closing sample, so short runs have at least one
+    
+    def enter_stage(self, stage: str):
+        with self._lock:
+            self.active_stages[stage] = self.active_stages.get(stage, 0) + 1
+        self.sample()
+    
+    def exit_stage(self, stage: str):
+        self.sample()
+        with self._lock:
+            self.active_stages[stage] -= 1
+            if not self.active_stages[stage]:
+                del self.active_stages[stage]
+    
+    def stage_peak(self, stage: str) -> Optional[Dict[str, float]]:
+        with self._lock:
+            peak = self.stage_peaks.get(stage)
+            return dict(peak) if peak else None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+    
+    def sample(self):
+        import psutil
+        
+        try:
+            rss_gb = psutil.Process().memory_info().rss / (1024**3)
+            available_gb = psutil.virtual_memory().available / (1024**3)
+        except Exception:
+            return
+        accelerator_gb = accelerator_allocated_gb(self.device)
+        
+        with self._lock:
+            self.samples.append((time.perf_counter() - self._start, rss_gb, available_gb, accelerator_gb))
+            for stage in self.active_stages or ["other"]:
+                peak = self.stage_peaks.setdefault(stage, {
+                    "rss_gb": 0.0, "min_available_gb": float("inf"), "accelerator_gb": 0.0
+                })
+                peak["rss_gb"] = max(peak["rss_gb"], rss_gb)
+                peak["min_available_gb"] = min(peak["min_available_gb"], available_gb)
+                peak["accelerator_gb"] = max(peak["accelerator_gb"], accelerator_gb)
+    
+    def summary(self, points: int = MEMORY_TIMELINE_POINTS) -> Dict[str, Any]:
+        """Overall and per-stage peaks plus a timeline downsampled to at most points entries
+        
+        Each timeline point keeps the worst values of the samples it covers:
+        [seconds, rss_gb, available_gb, accelerator_gb].
+        """
+        with self._lock:
+            samples = list(self.samples)
+            stages = {stage: {name: round(value, 3) for name, value in peak.items()}
+                      for stage, peak in self.stage_peaks.items()}
+        if not samples:
+            return {}
+        
+        bucket = -(-len(samples) // points)  # Ceiling division
+        timeline = []
+        for i in range(0, len(samples), bucket):
+            chunk = samples[i:i + bucket]
+            timeline.append([
+                round(chunk[0][0], 2),
+                round(max(sample[1] for sample in chunk), 3),
+                round(min(sample[2] for sample in chunk), 3),
+                round(max(sample[3] for sample in chunk), 3)
+            ])
+        
+        return {
+            "interval": self.interval,
+            "samples": len(samples),
+            "peak_rss_gb": max(sample[1] for sample in samples),
+            "min_available_gb": min(sample[2] for sample in samples),
+            "peak_accelerator_gb": max(sample[3] for sample in samples),
+            "stages": stages,
+            "timeline": timeline
+        }
+
+# Identifies a loaded pipeline in the PipelineCache. shared_from names the
+# pipeline whose components (VAE, text encoders) this one borrows.
+PipelineKey = namedtuple("PipelineKey", ["model", "pipeline_class", "dtype", "lora", "controlnet", "shared_from",
+                                         "device", "quantize", "offload", "lora_scale", "fuse_lora", "compile"])
+
+def pipeline_key(model_name: str, pipeline_class: str, dtype, lora: Optional[str] = None,
+                 controlnet: Optional[str] = None, shared_from: Optional[str] = None,
+                 device: Optional[str] = None, quantize: Optional[str] = None,
+                 offload: bool = False, lora_scale: float = 1.0, fuse_lora: bool = False,
+                 compile: bool = False) -> PipelineKey:
+    """Cache key of a loaded pipeline (LoRA weights are loaded or fused into it)
+    
+    compile marks pipelines whose modules --compile replaced with compiled ones.
+    """
+    return PipelineKey(model_name, pipeline_class, str(dtype), lora, controlnet, shared_from, device, quantize,
+                       offload, lora_scale, fuse_lora, compile)
+
+def pipeline_tensors(pipeline):
+    """Yield every weight tensor held by a pipeline's modules (or a bare model)"""
+    import torch
+    
+    if isinstance(pipeline, torch.nn.Module):
+        yield from pipeline.parameters()
+        yield from pipeline.buffers()
+        return
+    for component in getattr(pipeline, "components", {}).values():
+        if isinstance(component, torch.nn.Module):
+            yield from component.parameters()
+            yield from component.buffers()
+
+def estimate_pipeline_size_gb(pipeline, exclude_ids=frozenset()) -> float:
+    """Approximate memory held by a pipeline's weights
+    
+    Tensors whose id is in exclude_ids (e.g. components shared with another
+    cached pipeline) are not counted.
+    """
+    total_bytes = 0
+    seen = set(exclude_ids)
+    for tensor in pipeline_tensors(pipeline):
+        if id(tensor) in seen:
+            continue
+        seen.add(id(tensor))
+        total_bytes += tensor.numel() * tensor.element_size()
+    return total_bytes / (1024**3)
+
+def memory_plan_name(options) -> str:
+    return ",".join(options) or "none"
+
+def predict_generation_gb(model_family: str, width: int, height: int, batch_size: int, dtype,
+                          options=(), offloadable_gb: float = 0.0, fused_attention: bool = True) -> float:
+    """Memory one pipeline call needs on top of what is already allocated
+
+    The denoiser and the VAE decode run one after the other, so the peak is
+    the larger of the two. Model offload gives back offloadable_gb (the
+    weights that leave the accelerator while another component runs).
+    """
+    import torch
+    
+    megapixels = width * height / 1e6
+    scale = torch.finfo(dtype).bits / 16
+
+    attention_gb = PLAN_ATTENTION_GB_PER_MEGAPIXEL[model_family] * megapixels * batch_size
+    if fused_attention:
+        attention_gb *= PLAN_FUSED_ATTENTION_FACTOR
+    elif "attention_slicing" in options:
+        attention_gb *= PLAN_ATTENTION_SLICING_FACTOR
+    denoise_gb = attention_gb + PLAN_DENOISE_GB_PER_MEGAPIXEL[model_family] * megapixels * batch_size
+
+    decode_megapixels = min(megapixels, PLAN_VAE_TILE_MEGAPIXELS) if "vae_tiling" in options else megapixels
+    decode_images = 1 if "vae_slicing" in options else batch_size
+    decode_gb = PLAN_VAE_GB_PER_MEGAPIXEL * decode_megapixels * decode_images
+
+    peak_gb = max(denoise_gb, decode_gb) * scale
+    if "model_offload" in options:
+        peak_gb -= offloadable_gb
+    return peak_gb
+
+def plan_memory(model_family: str, width: int, height: int, batch_size: int, dtype, budget_gb: float,
+                offloadable_gb: Optional[float] = None, required=(),
+                fused_attention: bool = True) -> Dict[str, Any]:
+    """Pick the fastest memory plan whose predicted peak fits in budget_gb
+
+    Model offload is only a candidate when offloadable_gb is given (it frees
+    accelerator memory, which CPU and unified-memory devices don't have).
+    Attention slicing is dropped from the plans with fused attention kernels.
+    Options in required (e.g. VAE tiling past --vae-tiling-threshold) are
+    part of every plan.
+    Falls back to the most frugal plan when nothing fits.
+    """
+    candidates = []
+    for options in MEMORY_PLANS:
+        if "model_offload" in options and offloadable_gb is None:
+            continue
+        if fused_attention:
+            options = tuple(option for option in options if option != "attention_slicing")
+        options = options + tuple(option for option in required if option not in options)
+        if any(options == seen for seen, _ in candidates):
+            continue
+        predicted_gb = predict_generation_gb(model_family, width, height, batch_size, dtype,
+                                             options, offloadable_gb or 0.0, fused_attention)
+        candidates.append((options, predicted_gb))
+
+    options, predicted_gb = next(((options, predicted_gb) for options, predicted_gb in candidates
+                                  if predicted_gb <= budget_gb), candidates[-1])
+    return {
+        "plan": memory_plan_name(options),
+        "options": list(options),
+        "budget_gb": round(budget_gb, 3),
+        "predicted_gb": round(predicted_gb, 3),
+        "fits": predicted_gb <= budget_gb,
+        "candidates": {memory_plan_name(options): round(predicted_gb, 3) for options, predicted_gb in candidates}
+    }
+
+def apply_memory_plan(pipe, options, device: str):
+    """Switch a pipeline's memory optimizations to exactly the planned ones
+
+    Optimizations outside the plan are turned off again, since resident
+    pipelines are reused by runs with different plans.
+    """
+    try:
+        if "attention_slicing" in options:
+            pipe.enable_attention_slicing()
+        else:
+            pipe.disable_attention_slicing()
+    except Exception:
+        pass  # Not every denoiser supports sliced attention
+
+    vae = getattr(pipe, "vae", None)
+    if vae is not None and hasattr(vae, "use_slicing"):
+        if "vae_slicing" in options:
+            vae.enable_slicing()
+        else:
+            vae.disable_slicing()
+    if vae is not None and hasattr(vae, "use_tiling"):
+        # Tiles overlap and are blended, so tiled decodes have no seams
+        if "vae_tiling" in options:
+            vae.enable_tiling()
+        else:
+            vae.disable_tiling()
+
+    offloaded = bool(getattr(pipe, "_all_hooks", None))
+    if "model_offload" in options and not offloaded:
+        if getattr(pipe, "hf_device_map", None):
+            pipe.reset_device_map()  # Offload hooks can't be added to a device-mapped pipeline
+        pipe.enable_model_cpu_offload(device=device)
+    elif "model_offload" not in options and offloaded:
+        pipe.remove_all_hooks()
+        pipe.to(device)
+
+def tensor_size_bytes(tensor) -> int:
+    """Bytes held by a tensor, counting the int8 data and scales inside quantized tensors"""
+    if hasattr(tensor, "__tensor_flatten__"):  # torchao tensor subclass
+        names, _ = tensor.__tensor_flatten__()
+        return sum(tensor_size_bytes(getattr(tensor, name)) for name in names)
+    return tensor.numel() * tensor.element_size()
+
+def module_size_bytes(module) -> int:
+    """Bytes held by a module's weights, including the int8 weights of quantized layers"""
+    return sum(tensor_size_bytes(t) for t in list(module.parameters()) + list(module.buffers()))
+
+def quantize_int8(module):
+    """Dynamic int8 quantization of a module's Linear layers, in place (needs torchao)
+    
+    Weights are stored as int8; activations are quantized on the fly per
+    call, so no calibration data is needed.
+    """
+    from torchao.quantization import quantize_, Int8DynamicActivationInt8WeightConfig
+    quantize_(module, Int8DynamicActivationInt8WeightConfig())
+    return module
+
+def compile_module(module, name: str):
+    """Compile a module in place, falling back to eager for it alone if compilation fails
+    
+    torch.compile is lazy, so failures surface on the first call; they are
+    reported there and recorded in module._compile_error.
+    """
+    import torch._dynamo
+    
+    module.compile()
+    compiled_call = module._compiled_call_impl
+    
+    def call(*args, **kwargs):
+        try:
+            return compiled_call(*args, **kwargs)
+        except torch._dynamo.exc.TorchDynamoException as e:
+            module._compiled_call_impl = None  # Eager from now on
+            cause = getattr(e, "inner_exception", None) or e  # What the backend raised
+            module._compile_error = f"{type(cause).__name__}: {(str(cause).splitlines() or [''])[0]}"
+            print(f"⚠️  Compile skipped for {name} - running it eager ({module._compile_error})")
+            return module._call_impl(*args, **kwargs)
+    
+    module._compiled_call_impl = call
+
+def compile_errors(pipe) -> Dict[str, str]:
+    """Modules of a pipeline whose compilation failed, with the reason"""
+    modules = {name: getattr(pipe, name, None) for name in ("unet", "controlnet", "transformer")}
+    modules["vae.decoder"] = getattr(getattr(pipe, "vae", None), "decoder", None)
+    return {name: module._compile_error for name, module in modules.items()
+            if getattr(module, "_compile_error", None)}
+
+def compile_pipeline_modules(pipe) -> List[str]:
+    """Convert a pipeline's denoiser and VAE decoder to channels_last and compile them in place
+    
+    Modules compiled earlier (resident pipelines), or whose compilation
+    failed, are left alone. Returns the names of the modules compiled now.
+    """
+    import torch
+    
+    compiled = []
+    for name in ("unet", "controlnet", "transformer"):
+        module = getattr(pipe, name, None)
+        if (module is None or getattr(module, "_compiled_call_impl", None) is not None
+                or getattr(module, "_compile_error", None)):
+            continue
+        if name != "transformer":  # Transformers work on token sequences, not NCHW
+            module.to(memory_format=torch.channels_last)
+        compile_module(module, name)
+        compiled.append(name)
+    
+    vae = getattr(pipe, "vae", None)
+    if (vae is not None and getattr(vae.decoder, "_compiled_call_impl", None) is None
+            and not getattr(vae.decoder, "_compile_error", None)):
+        vae.to(memory_format=torch.channels_last)
+        compile_module(vae.decoder, "vae.decoder")
+        compiled.append("vae.decoder")
+    
+    return compiled
+
+def compile_artifacts_path(*parts) -> Path:
+    """Saved compile artifacts for a model/shape/dtype combination"""
+    import torch
+    
+    payload = json.dumps([str(part) for part in parts] + [torch.__version__])
+    return COMPILE_CACHE_DIR / f"{hashlib.sha256(payload.encode('utf-8')).hexdigest()}.bin"
+
+def load_step_times() -> Dict[str, Dict[str, float]]:
+    """Median step time per run configuration and mode (eager / compiled)"""
+    try:
+        with open(STEP_TIMES_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_step_time(key: str, mode: str, step_time: float):
+    """Remember the latest median step time for a run configuration"""
+    step_times = load_step_times()
+    step_times.setdefault(key, {})[mode] = step_time
+    STEP_TIMES_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(STEP_TIMES_PATH, 'w') as f:
+        json.dump(step_times, f, indent=2)
+
+def tiled_upscale(images, scale: int, tile_size: int = UPSCALE_TILE_SIZE, workers: Optional[int] = None):
+    """LANCZOS-upscale images by an integer factor, resampling tiles in parallel
+    
+    Each tile is resized straight from its full source image (resize box), so
+    its filter window overlaps the neighbouring tiles and the stitched result
+    matches a whole-image resize pixel for pixel. Tiles of all images share
+    one thread pool (PIL releases the GIL while resampling).
+    """
+    from PIL import Image
+    
+    tiles = []
+    outputs = []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for image in images:
+            image.load()
+            width, height = image.size
+            output = Image.new(image.mode, (width * scale, height * scale))
+            outputs.append(output)
+            
+            for top in range(0, height, tile_size):
+                for left in range(0, width, tile_size):
+                    box = (left, top, min(left + tile_size, width), min(top + tile_size, height))
+                    size = ((box[2] - left) * scale, (box[3] - top) * scale)
+                    tile = pool.submit(image.resize, size, Image.LANCZOS, box=box)
+                    tiles.append((output, (left * scale, top * scale), tile))
+        
+        for output, position, tile in tiles:
+            output.paste(tile.result(), position)
+    
+    return outputs
+
+def snapshot_path(model_name: str, dtype) -> Path:
+    """Directory of a model's local snapshot in the given dtype"""
+    name = model_name.strip("/").replace("/", "--")
+    return SNAPSHOT_DIR / f"{name}--{str(dtype).replace('torch.', '')}"
+
+def model_source(model_name: str, dtype):
+    """(path, "snapshot") when --warm-cache saved this model in this dtype, else (model_name, "hub")"""
+    path = snapshot_path(model_name, dtype)
+    if (path / SNAPSHOT_MARKER).exists():
+        return str(path), "snapshot"
+    return model_name, "hub"
+
+def warm_model(model_name: str, model_family: str, dtype) -> Dict[str, Any]:
+    """Save one model as a local snapshot and time loading it both ways"""
+    import shutil
+    import torch
+    import diffusers
+    from diffusers import DiffusionPipeline
+    
+    path = snapshot_path(model_name, dtype)
+    load_kwargs = {"torch_dtype": dtype, "low_cpu_mem_usage": True}
+    extra = {}
+    if model_family == "sd15":
+        extra = {"safety_checker": None, "requires_safety_checker": False}
+    elif model_family == "sdxl" and dtype == torch.float16:
+        extra = {"variant": "fp16"}
+    
+    start = time.time()
+    pipe = DiffusionPipeline.from_pretrained(model_name, **load_kwargs, **extra)
+    hub_load_time = time.time() - start
+    
+    # Write next to the final directory and rename, so loaders never see half a snapshot
+    staging = path.with_name(path.name + ".partial")
+    if staging.exists():
+        shutil.rmtree(staging)
+    pipe.save_pretrained(staging, safe_serialization=True)
+    size_gb = estimate_pipeline_size_gb(pipe)
+    del pipe
+    gc.collect()
+    
+    with open(staging / SNAPSHOT_MARKER, "w") as f:
+        json.dump({
+            "model": model_name,
+            "dtype": str(dtype),
+            "diffusers": diffusers.__version__,
+            "created": datetime.now().isoformat()
+        }, f, indent=2)
+    staging.rename(path)
+    
+    start = time.time()
+    pipe = DiffusionPipeline.from_pretrained(str(path), **load_kwargs, use_safetensors=True)
+    snapshot_load_time = time.time() - start
+    del pipe
+    gc.collect()
+    
+    return {"size_gb": size_gb, "hub_load_time": hub_load_time, "snapshot_load_time": snapshot_load_time}
+
+def warm_cache(preset_names: List[str], device_name: str = "auto") -> int:
+    """Snapshot every model and refiner of the given presets (--warm-cache)"""
+    try:
+        device = resolve_device(device_name)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return 1
+    
+    models = {}  # model -> family, in preset order
+    for name in preset_names:
+        preset = QUALITY_PRESETS[name]
+        family = "sd3" if preset.get("use_sd3") else "sdxl" if "xl" in preset["model"].lower() else "sd15"
+        models.setdefault(preset["model"], family)
+        if preset.get("refiner"):
+            models.setdefault(preset["refiner"], "sdxl" if "xl" in preset["refiner"].lower() else "sd15")
+    
+    print(f"🔥 Warming {len(models)} model(s) for {device} into {SNAPSHOT_DIR}")
+    failed = 0
+    for model_name, family in models.items():
+        dtype = resolve_dtype(device, family)
+        if model_source(model_name, dtype)[1] == "snapshot":
+            print(f"✓ {model_name} ({dtype}): already warm")
+            continue
+        
+        print(f"Converting {model_name} to {dtype}...")
+        try:
+            result = warm_model(model_name, family, dtype)
+        except Exception as e:
+            print(f"✗ {model_name}: {e}")
+            failed += 1
+            continue
+        print(f"✓ {model_name} ({result['size_gb']:.1f}GB): load {result['hub_load_time']:.1f}s from the original, "
+              f"{result['snapshot_load_time']:.1f}s from the snapshot")
+    
+    return 1 if failed else 0
+
+def resolve_pipeline_config(args):
+    """Resolve the (model, LoRA, refiner) a request will load once presets apply"""
+    preset = QUALITY_PRESETS.get(args.quality, {}) if args.quality else {}
+    if args.model:
+        model = args.model
+    elif args.pro:
+        model = "stabilityai/stable-diffusion-3.5-large-turbo"
+    else:
+        model = preset.get("model", DEFAULT_MODEL)
+    lora = args.lora or preset.get("lora")
+    refiner = args.refiner or preset.get("refiner")
+    return model, lora, refiner
+
+def resolve_pipeline_settings(args):
+    """The other options that key a request's pipelines in the PipelineCache (see PipelineKey)"""
+    lora = resolve_pipeline_config(args)[1]
+    return (args.device, args.quantize or "", args.offload, bool(args.compile),
+            args.lora_scale if lora else 1.0, bool(args.fuse_lora and lora),
+            bool(args.depth), bool(args.share_components))
+
+class PipelineCache:
+    """Keeps loaded pipelines resident between runs (daemon, batch jobs)
+    
+    Entries are kept in least-recently-used order. When the estimated size
+    of all entries exceeds budget_gb, or system memory drops below
+    min_free_gb, the least recently used pipelines are evicted - except
+    those the running request still holds, since dropping them frees nothing.
+    """
+    
+    def __init__(self, budget_gb: float = 0, min_free_gb: float = CACHE_MIN_FREE_GB):
+        self.budget_gb = budget_gb  # 0 = no fixed budget, evict on memory pressure only
+        self.min_free_gb = min_free_gb
+        self.entries = OrderedDict()  # key -> (pipeline, size_gb)
+    
+    def get(self, key):
+        """Return the cached pipeline for key (marking it recently used), or None"""
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+    
+    def put(self, key, pipeline, in_use=()):
+        """Store a loaded pipeline under key, evicting older entries if needed
+        
+        in_use lists the pipelines the caller still holds (see enforce_budget).
+        """
+        # Components shared with pipelines already cached don't cost memory twice
+        shared_ids = {id(tensor) for other_key, (other, _) in self.entries.items()
+                      if other_key != key for tensor in pipeline_tensors(other)}
+        self.entries[key] = (pipeline, estimate_pipeline_size_gb(pipeline, shared_ids))
+        self.entries.move_to_end(key)
+        self.enforce_budget(in_use=(pipeline, *in_use))
+    
+    def discard(self, key):
+        """Drop a pipeline from the cache so its memory can be released"""
+        self.entries.pop(key, None)
+    
+    def total_size_gb(self) -> float:
+        """Estimated size of every cached pipeline"""
+        return sum(size for _, size in self.entries.values())
+    
+    def under_pressure(self) -> bool:
+        """Whether the cache is over budget or a device holding entries is low on memory"""
+        if self.budget_gb and self.total_size_gb() > self.budget_gb:
+            return True
+        # CUDA entries live in VRAM; everything else (CPU, MPS unified memory) in system RAM
+        for device in {key.device or "cpu" for key in self.entries} or {"cpu"}:
+            available_gb = available_memory_gb(device)
+            if available_gb is not None and available_gb < self.min_free_gb:
+                return True
+        return False
+    
+    def enforce_budget(self, in_use=()):
+        """Evict least-recently-used pipelines until the cache fits
+        
+        Pipelines in in_use are held by the running request, so evicting
+        them (or an entry whose weights all belong to them) would free no
+        memory. Those are skipped, and eviction stops once nothing else is left.
+        """
+        held = [pipeline for pipeline in in_use if pipeline is not None]
+        held_ids = {id(pipeline) for pipeline in held}
+        held_tensors = {id(tensor) for pipeline in held for tensor in pipeline_tensors(pipeline)}
+        
+        def frees_memory(pipeline) -> bool:
+            if id(pipeline) in held_ids:
+                return False
+            return any(id(tensor) not in held_tensors for tensor in pipeline_tensors(pipeline))
+        
+        while self.under_pressure():
+            key = next((key for key, (pipeline, _) in self.entries.items() if frees_memory(pipeline)), None)
+            if key is None:
+                break  # Everything left is in use by the running request
+            _, size_gb = self.entries.pop(key)
+            print(f"🧹 Evicting cached pipeline: {key.model} ({key.pipeline_class}, ~{size_gb:.1f}GB)")
+            cleanup_memory(aggressive=True)
+    
+    def retain(self, keep):
+        """Drop every cached pipeline for which keep(key) is false"""
+        dropped = [key for key in self.entries if not keep(key)]
+        for key in dropped:
+            del self.entries[key]
+        if dropped:
+            cleanup_memory(aggressive=True)
+    
+    def clear(self):
+        """Drop every cached pipeline"""
+        self.entries.clear()
+        cleanup_memory(aggressive=True)
+
+class PromptEmbeddingCache:
+    """Encoded prompt embeddings with an in-memory LRU tier and an on-disk tier
+    
+    Entries are keyed by a hash of the model, text-encoder dtype, LoRA and the
+    exact prompt / negative prompt text, and hold every tensor the pipeline
+    accepts in place of raw strings (including pooled embeddings for SDXL
+    and SD 3.5). Tensors are kept on the CPU and moved to the device on use.
+    """
+    
+    def __init__(self, cache_dir: Path = EMBEDDING_CACHE_DIR, max_entries: int = EMBEDDING_CACHE_ENTRIES,
+                 max_disk_gb: float = EMBEDDING_CACHE_MAX_DISK_GB):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self.max_disk_gb = max_disk_gb
+        self.memory = OrderedDict()
+    
+    @staticmethod
+    def make_key(model_name: str, dtype, lora: Optional[str], prompt: str, negative_prompt: str) -> str:
+        """Hash everything that changes the encoder output"""
+        payload = json.dumps([model_name, str(dtype), lora, prompt, negative_prompt])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str):
+        """Return (embeddings, tier) for key, or (None, "miss")"""
+        import torch
+        
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key], "memory"
+        
+        path = self.cache_dir / f"{key}.pt"
+        if path.exists():
+            try:
+                embeds = torch.load(path, map_location="cpu", weights_only=True)
+            except Exception as e:
+                print(f"⚠️  Ignoring unreadable embedding cache entry: {e}")
+                return None, "miss"
+            path.touch()  # Keep recently used entries from being evicted
+            self._remember(key, embeds)
+            return embeds, "disk"
+        
+        return None, "miss"
+    
+    def put(self, key: str, embeds: Dict[str, Any]):
+        """Store embeddings in memory and on disk"""
+        import torch
+        
+        embeds = {name: tensor.detach().to("cpu") for name, tensor in embeds.items()}
+        self._remember(key, embeds)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            torch.save(embeds, self.cache_dir / f"{key}.pt")
+            self._evict_disk()
+        except OSError as e:
+            print(f"⚠️  Could not write embedding cache: {e}")
+        return embeds
+    
+    def _remember(self, key: str, embeds):
+        self.memory[key] = embeds
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+    
+    def _evict_disk(self):
+        """Delete the least recently used files once the disk tier is over its limit"""
+        files = sorted(self.cache_dir.glob("*.pt"), key=lambda path: path.stat().st_mtime)
+        total_bytes = sum(path.stat().st_size for path in files)
+        limit_bytes = self.max_disk_gb * (1024**3)
+        while files and total_bytes > limit_bytes:
+            oldest = files.pop(0)
+            total_bytes -= oldest.stat().st_size
+            oldest.unlink()
+
+_prompt_embedding_cache = None
+
+def get_prompt_embedding_cache() -> PromptEmbeddingCache:
+    """Process-wide embedding cache (shared across daemon requests and jobs)"""
+    global _prompt_embedding_cache
+    if _prompt_embedding_cache is None:
+        _prompt_embedding_cache = PromptEmbeddingCache()
+    return _prompt_embedding_cache
+
 class ImageGenerator:
-    def __init__(self, args):
+    def __init__(self, args, pipeline_cache: Optional[PipelineCache] = None):
         self.args = args
-        self.device = "mps"
-        # Use float32 on MPS to avoid VAE decode issues
-        self.dtype = torch.float32
+        self.pipeline_cache = pipeline_cache
+        self.pipeline_key = None  # Cache key of the resident base pipeline
+        self.pipeline_from_cache = False
+        self.device = configure_backend(args)
+        # Refined per model family once the base pipeline loads
+        self.dtype = resolve_dtype(self.device, "sd15")
         self.pipeline = None
         self.refiner_pipeline = None  # Keep track of refiner separately
+        self.refiner_timing = {"loads": 0, "load_time": 0.0, "inference_time": 0.0, "images": 0, "batches": []}
+        self.refiner_load_failed = False
         self.is_sd3 = False  # Track if using SD 3.5
+        self.offload = False  # SD 3.5 loaded in stages (see sd3_offload_enabled)
+        self.lora_fused = False  # --fuse-lora applies (see lora_fusion_enabled)
+        self.lora_fusion_cache = None  # Components loaded pre-fused by the base pipeline load
+        self.model_family = "sd15"  # sd15, sdxl or sd3 (set when the base pipeline loads)
+        self.step_times = []  # Per pipeline call, seconds per denoising step
+        self.compile_artifacts = None  # Where to save compile artifacts after a cache miss
+        self.run_start = time.perf_counter()
+        self.profiler = None  # torch profiler while --profile records a trace
+        self.memory_sampler = None  # Background MemorySampler during run()
         self.metadata = {
             "device": self.device,
             "dtype": str(self.dtype),
             "failures": [],
-            "warnings": []
+            "warnings": [],
+            "spans": []  # {"stage", "start", "duration", ...} relative to the start of the run
         }
         
         # Log initial memory state
@@ -260,6 +1139,60 @@ class ImageGenerator:
         print()
         self.metadata["quality_preset"] = preset_name
         
+    @contextmanager
+    def span(self, stage: str, **detail):
+        """Time a stage into the metadata spans (and the profiler trace with --profile)
+        
+        Safe to use from the writer threads.
+        """
+        import torch
+        
+        start = time.perf_counter()
+        sampler = self.memory_sampler
+        if sampler is not None:
+            sampler.enter_stage(stage)
+        with torch.profiler.record_function(stage) if self.profiler is not None else nullcontext():
+            try:
+                yield
+            finally:
+                if sampler is not None:
+                    sampler.exit_stage(stage)
+                self.metadata["spans"].append({
+                    "stage": stage,
+                    "start": start - self.run_start,
+                    "duration": time.perf_counter() - start,
+                    **detail
+                })
+    
+    def start_profiler(self):
+        """Record a torch profiler trace of the run (--profile)"""
+        from torch.profiler import profile, ProfilerActivity
+        
+        activities = [ProfilerActivity.CPU]
+        if self.device == "cuda":
+            activities.append(ProfilerActivity.CUDA)
+        
+        output_dir = Path(self.args.output)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self.trace_path = output_dir / f"trace_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
+        self.metadata["profile_trace"] = self.trace_path.name
+        
+        self.profiler = profile(activities=activities)
+        self.profiler.start()
+        print(f"🔬 Profiling run (trace: {self.trace_path})")
+    
+    def stop_profiler(self):
+        """Stop profiling and export the Chrome trace (open in chrome://tracing or Perfetto)"""
+        if self.profiler is None:
+            return
+        profiler, self.profiler = self.profiler, None
+        try:
+            profiler.stop()
+            profiler.export_chrome_trace(str(self.trace_path))
+            print(f"🔬 Saved profiler trace: {self.trace_path}")
+        except Exception as e:
+            self.log_warning(f"Could not export profiler trace: {e}")
+    
     def log_failure(self, component: str, error: str, retry_count: int):
         """Log failure information"""
         self.metadata["failures"].append({
@@ -299,54 +1232,85 @@ class ImageGenerator:
     
     def load_base_pipeline(self):
         """Load base Stable Diffusion pipeline with memory management"""
+        import torch
         from diffusers import StableDiffusionPipeline, StableDiffusionXLPipeline, DiffusionPipeline
         
-        model_name = self.args.model if self.args.model else "Lykon/DreamShaper-8"
+        model_name = self.args.model if self.args.model else DEFAULT_MODEL
         
         # Detect model type
         is_sdxl = "xl" in model_name.lower()
         is_sd3 = "3.5" in model_name or "3-5" in model_name or hasattr(self.args, 'use_sd3')
         self.is_sd3 = is_sd3
+        self.model_family = "sd3" if is_sd3 else "sdxl" if is_sdxl else "sd15"
+        
+        self.dtype = resolve_dtype(self.device, self.model_family)
+        self.offload = self.sd3_offload_enabled()
+        self.metadata["offload"] = "staged" if self.offload else "off"
+        quantize = "int8" if self.quantization_enabled() else None
+        if quantize:
+            self.dtype = torch.float32  # Dynamic int8 kernels take float32 activations
+        self.metadata["dtype"] = str(self.dtype)
+        self.lora_fused = self.lora_fusion_enabled()
+        
+        # Reuse a resident pipeline (daemon mode) instead of reloading it
+        if is_sd3:
+            pipeline_class = "DiffusionPipeline"
+        elif is_sdxl:
+            pipeline_class = "StableDiffusionXLPipeline"
+        else:
+            pipeline_class = "StableDiffusionPipeline"
+        self.pipeline_key = pipeline_key(model_name, pipeline_class, self.dtype, self.args.lora,
+                                         device=self.device, quantize=quantize, offload=self.offload,
+                                         lora_scale=self.args.lora_scale if self.args.lora else 1.0,
+                                         fuse_lora=self.lora_fused, compile=bool(self.args.compile))
+        cached = None
+        if self.pipeline_cache is not None:
+            cached = self.pipeline_cache.get(self.pipeline_key)
+            if cached is None:
+                self.pipeline_cache.enforce_budget(in_use=self.held_pipelines())  # Make room before loading
+            self.metadata["pipeline_cache"] = "hit" if cached is not None else "miss"
         
         # Aggressive memory cleanup before loading large models
-        if is_sd3 or is_sdxl:
+        if cached is None and (is_sd3 or is_sdxl):
             print("🧹 Preparing memory for large model...")
             cleanup_memory(aggressive=True)
             log_memory_status("Before model load")
         
         def load_fn():
             print(f"Loading model: {model_name}")
+            # A --warm-cache snapshot is already in self.dtype - no conversion on load
+            source, self.metadata["model_source"] = model_source(model_name, self.dtype)
+            from_snapshot = self.metadata["model_source"] == "snapshot"
+            if from_snapshot:
+                print(f"  → Using local snapshot: {source}")
+            # int8 weights quantized by an earlier run, loaded once the components are quantized
+            quantized = self.load_quantized_weights(model_name) if quantize else {}
+            # So do components an earlier --fuse-lora run fused the LoRA into
+            self.lora_fusion_cache = self.load_fused_lora_components(model_name) if self.lora_fused else {}
             
             if is_sd3:
                 print("  → Detected SD 3.5 model (gated - requires HF authentication)")
                 print("  → Run ./login-hf.sh if not authenticated")
-                print("  → Enabling aggressive memory optimization for SD 3.5")
                 
                 # Clean memory before loading
                 cleanup_memory(aggressive=True)
                 
-                # Load with memory-efficient settings
-                pipe = DiffusionPipeline.from_pretrained(
-                    model_name,
-                    torch_dtype=torch.bfloat16,
-                    device_map=self.device,
-                    low_cpu_mem_usage=True,
-                    use_safetensors=True
-                )
-                
-                # Enable memory optimizations
-                try:
-                    pipe.enable_attention_slicing(slice_size="auto")
-                    print("  → Enabled attention slicing")
-                except:
-                    pass
+                if self.offload:
+                    # The text encoders only load while prompts are encoded (encode_prompt_staged)
+                    print("  → Offload mode: loading transformer and VAE only")
+                    pipe = self.load_sd3_components(source, text_encoder=None, text_encoder_2=None,
+                                                    text_encoder_3=None)
+                else:
+                    # Load with memory-efficient settings
+                    pipe = DiffusionPipeline.from_pretrained(
+                        source,
+                        torch_dtype=self.dtype,
+                        device_map=self.device,
+                        low_cpu_mem_usage=True,
+                        use_safetensors=True,
+                        **self.lora_fusion_cache
+                    )
                 
-                try:
-                    pipe.enable_vae_slicing()
-                    print("  → Enabled VAE slicing")
-                except:
-                    pass
-                    
                 # Clean memory after loading
                 cleanup_memory(aggressive=True)
                 
@@ -357,124 +1321,415 @@ class ImageGenerator:
                 cleanup_memory(aggressive=False)
                 
                 pipe = StableDiffusionXLPipeline.from_pretrained(
-                    model_name,
+                    source,
                     torch_dtype=self.dtype,
-                    variant="fp16" if self.dtype == torch.float16 else None,
+                    variant="fp16" if self.dtype == torch.float16 and not from_snapshot else None,
                     use_safetensors=True,
-                    low_cpu_mem_usage=True
+                    low_cpu_mem_usage=True,
+                    **self.lora_fusion_cache
                 )
                 pipe = pipe.to(self.device)
-                pipe.enable_attention_slicing()
                 
-                try:
-                    pipe.enable_vae_slicing()
-                    print("  → Enabled VAE slicing")
-                except:
-                    pass
-                    
             else:
                 print("  → Using StableDiffusionPipeline")
                 pipe = StableDiffusionPipeline.from_pretrained(
-                    model_name,
+                    source,
                     torch_dtype=self.dtype,
                     safety_checker=None,
                     requires_safety_checker=False,
-                    low_cpu_mem_usage=True
+                    use_safetensors=True if from_snapshot else None,  # Hub: safetensors when published
+                    low_cpu_mem_usage=True,
+                    **self.lora_fusion_cache
                 )
                 pipe = pipe.to(self.device)
-                pipe.enable_attention_slicing()
+            
+            if quantize:
+                self.quantize_pipeline(pipe, model_name, quantized)
             
             return pipe
         
-        pipeline, success = self.retry_operation("Base Pipeline Load", load_fn)
-        
-        if not success:
-            raise RuntimeError("Failed to load base pipeline after multiple retries")
+        if cached is not None:
+            print(f"♻️  Reusing resident pipeline: {model_name}")
+            self.metadata["model_source"] = "resident"
+            pipeline = cached
+            self.pipeline_from_cache = True
+        else:
+            pipeline, success = self.retry_operation("Base Pipeline Load", load_fn)
+            
+            if not success:
+                raise RuntimeError("Failed to load base pipeline after multiple retries")
         
         self.pipeline = pipeline
         self.metadata["model"] = model_name
         
+        # Memory optimizations are planned per run in plan_memory()
         if is_sd3:
             self.metadata["pipeline_type"] = "DiffusionPipeline (SD 3.5)"
-            self.metadata["memory_optimizations"] = "attention_slicing,vae_slicing,aggressive_cleanup"
         elif is_sdxl:
             self.metadata["pipeline_type"] = "StableDiffusionXLPipeline"
-            self.metadata["memory_optimizations"] = "attention_slicing,vae_slicing"
         else:
             self.metadata["pipeline_type"] = "StableDiffusionPipeline"
-            self.metadata["memory_optimizations"] = "attention_slicing"
         
         # Log memory after loading
         log_memory_status("After model load")
-        
-    def apply_lora(self):
-        """Apply LoRA weights if specified"""
-        if not self.args.lora:
-            return True
-            
-        def load_lora_fn():
-            print(f"Loading LoRA: {self.args.lora}")
-            self.pipeline.load_lora_weights(self.args.lora)
-            return True
-        
-        result, success = self.retry_operation("LoRA Load", load_lora_fn)
-        
-        if success:
-            self.metadata["lora"] = self.args.lora
+    
+    def sd3_offload_enabled(self) -> bool:
+        """Whether SD 3.5 loads in stages: --offload on, or auto when memory is short"""
+        if not self.is_sd3:
+            return False
+        if self.args.offload == "on":
+            print("🧩 Offload mode: SD 3.5 components load one stage at a time")
             return True
-        else:
-            self.log_warning("LoRA loading failed - continuing without LoRA")
-            self.metadata["lora"] = "failed"
+
+        available_gb = self.check_sd3_memory(warn=self.args.offload == "off")
+        if self.args.offload == "off" or available_gb is None or available_gb >= SD3_OFFLOAD_BELOW_GB:
             return False
+        print(f"🧩 Low memory ({available_gb:.1f}GB available) - loading SD 3.5 in stages with component offload")
+        return True
     
-    def setup_controlnet(self):
-        """Setup ControlNet if specified"""
-        controlnet_type = None
-        controlnet_image = None
+    def check_sd3_memory(self, warn: bool = True) -> Optional[float]:
+        """Memory available to SD 3.5 (free VRAM on CUDA), warning below SD3_OFFLOAD_BELOW_GB"""
+        available_gb = available_memory_gb(self.device)
+        if available_gb is None:
+            return None
         
-        if self.args.pose:
-            controlnet_type = "pose"
-            controlnet_image = self.args.pose
-        elif self.args.depth:
-            controlnet_type = "depth"
-            controlnet_image = self.args.depth
-        elif self.args.canny:
-            controlnet_type = "canny"
-            controlnet_image = self.args.canny
+        if warn and available_gb < SD3_OFFLOAD_BELOW_GB:
+            print(f"⚠️  WARNING: Low memory detected ({available_gb:.1f}GB available)")
+            print(f"   SD 3.5 requires 36GB+ RAM. Generation may fail or be very slow.")
+            print(f"   Use --offload auto (or on) to load it in stages, or --quality 4k-ultra (SDXL).")
+            self.log_warning(f"Low memory: {available_gb:.1f}GB available (36GB+ recommended for SD 3.5)")
+        return available_gb
+    
+    def load_sd3_components(self, model_name: str, **skipped):
+        """Load SD 3.5 without the components passed as None (offload mode)
         
-        if not controlnet_type:
-            return None
+        On CUDA only the component that is running sits in VRAM (model CPU
+        offload); elsewhere the loaded components go straight to the device.
+        """
+        from diffusers import DiffusionPipeline
         
-        def load_controlnet_fn():
-            from diffusers import ControlNetModel, StableDiffusionControlNetPipeline
+        if self.device == "cuda":
+            pipe = DiffusionPipeline.from_pretrained(
+                model_name,
+                torch_dtype=self.dtype,
+                low_cpu_mem_usage=True,
+                use_safetensors=True,
+                **skipped
+            )
+            pipe.enable_model_cpu_offload(device=self.device)
+            return pipe
+        
+        return DiffusionPipeline.from_pretrained(
+            model_name,
+            torch_dtype=self.dtype,
+            device_map=self.device,
+            low_cpu_mem_usage=True,
+            use_safetensors=True,
+            **skipped
+        )
+    
+    def quantization_enabled(self) -> bool:
+        """Whether --quantize applies to this run (CPU, UNet models, no LoRA)"""
+        if not getattr(self.args, "quantize", None):
+            return False
+        if self.device != "cpu":
+            self.log_warning(f"--quantize {self.args.quantize} is CPU-only - ignored on {self.device}")
+        elif self.model_family == "sd3":
+            self.log_warning(f"--quantize {self.args.quantize} does not support SD 3.5 - ignored")
+        elif self.args.lora:
+            self.log_warning(f"--quantize {self.args.quantize} can't load LoRA into int8 layers - ignored")
+        else:
+            return True
+        return False
+    
+    def quantized_cache_dir(self, model_name: str) -> Path:
+        """On-disk cache of a model's quantized weights"""
+        import torch
+        import diffusers
+        import torchao
+        
+        payload = json.dumps([model_name, "int8", torch.__version__, diffusers.__version__, torchao.__version__])
+        return QUANTIZED_CACHE_DIR / hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def load_quantized_weights(self, model_name: str) -> Dict[str, Any]:
+        """Quantized state dicts saved by an earlier run ({} if there are none)"""
+        import torch
+        
+        cache_dir = self.quantized_cache_dir(model_name)
+        if not (cache_dir / "sizes.json").exists():
+            return {}
+        
+        try:
+            with open(cache_dir / "sizes.json") as f:
+                sizes = json.load(f)
+            # Tensors only - nothing in the cache can run code when loaded
+            return {name: torch.load(cache_dir / f"{name}.pt", map_location="cpu", weights_only=True)
+                    for name in sizes}
+        except Exception as e:
+            self.log_warning(f"Could not load quantized weights - quantizing again: {e}")
+            return {}
+    
+    def quantize_pipeline(self, pipe, model_name: str, quantized: Dict[str, Any]):
+        """Quantize the text encoders and UNet to int8, caching their weights on disk
+        
+        quantized holds the state dicts that came from the cache; they are
+        loaded into the quantized components, replacing the weights
+        quantized from float32.
+        """
+        import torch
+        
+        cache_dir = self.quantized_cache_dir(model_name)
+        cache = "hit" if quantized else "miss"
+        sizes = {}
+        for name in QUANTIZE_COMPONENTS:
+            module = getattr(pipe, name, None)
+            if module is None:
+                continue
+            before = module_size_bytes(module)
+            quantize_int8(module)
+            if name in quantized:
+                try:
+                    module.load_state_dict(quantized[name], assign=True)
+                except Exception as e:
+                    self.log_warning(f"Could not load quantized {name} - using the weights quantized now: {e}")
+                    cache = "miss"
+            else:
+                cache = "miss"
+            sizes[name] = {"before": before, "after": module_size_bytes(module)}
+        
+        if cache == "miss":
+            try:
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                for name in sizes:
+                    torch.save(getattr(pipe, name).state_dict(), cache_dir / f"{name}.pt")
+                # Written last: marks the cache entry complete
+                with open(cache_dir / "sizes.json", 'w') as f:
+                    json.dump(sizes, f, indent=2)
+            except Exception as e:
+                self.log_warning(f"Could not cache quantized weights: {e}")
+        
+        before_gb = sum(size["before"] for size in sizes.values()) / (1024**3)
+        after_gb = sum(size["after"] for size in sizes.values()) / (1024**3)
+        print(f"  → int8 {', '.join(sizes)}: {before_gb:.2f}GB → {after_gb:.2f}GB "
+              f"({before_gb - after_gb:.2f}GB saved, cache {cache})")
+        self.metadata["quantization"] = {
+            "mode": "int8",
+            "components": list(sizes),
+            "cache": cache,
+            "size_before_gb": before_gb,
+            "size_after_gb": after_gb,
+            "ram_saved_gb": before_gb - after_gb
+        }
+    
+    def apply_lora(self):
+        """Apply LoRA weights if specified (fused into the weights with --fuse-lora)"""
+        if not self.args.lora:
+            return True
+        
+        scale = self.args.lora_scale
+        self.metadata["lora_scale"] = scale
+        
+        # Resident pipelines are cached with their LoRA already loaded (or fused)
+        if self.pipeline_from_cache:
+            self.metadata["lora"] = self.args.lora
+            if self.lora_fused:
+                self.metadata["lora_fusion"] = {"scale": scale, "cache": "resident"}
+            return True
+        
+        # Components fused by an earlier run came in with the model - nothing to load
+        if self.lora_fusion_cache:
+            print(f"  → LoRA pre-fused at scale {scale:g}: {', '.join(self.lora_fusion_cache)} (cache hit)")
+            self.metadata["lora"] = self.args.lora
+            self.metadata["lora_fusion"] = {"scale": scale, "cache": "hit",
+                                            "components": list(self.lora_fusion_cache)}
+            return True
+            
+        def load_lora_fn():
+            print(f"Loading LoRA: {self.args.lora}")
+            self.pipeline.load_lora_weights(self.args.lora)
+            return True
+        
+        result, success = self.retry_operation("LoRA Load", load_lora_fn)
+        
+        if success:
+            self.metadata["lora"] = self.args.lora
+            if self.lora_fused:
+                self.fuse_lora_weights()
+            elif scale != 1.0:
+                self.pipeline.set_adapters(self.pipeline.get_active_adapters(), adapter_weights=scale)
+            return True
+        else:
+            self.log_warning("LoRA loading failed - continuing without LoRA")
+            self.metadata["lora"] = "failed"
+            return False
+    
+    def lora_fusion_enabled(self) -> bool:
+        """Whether --fuse-lora applies to this run (a LoRA, and no SD 3.5 offload mode)"""
+        if not getattr(self.args, "fuse_lora", False):
+            return False
+        if not self.args.lora:
+            self.log_warning("--fuse-lora without a LoRA - ignored")
+        elif self.offload:
+            self.log_warning("--fuse-lora can't fuse into text encoders loaded per prompt (offload mode) "
+                             "- LoRA applied unfused")
+        else:
+            return True
+        return False
+    
+    def fused_lora_dir(self, model_name: str) -> Path:
+        """On-disk cache of a model's components with the LoRA fused in at --lora-scale"""
+        import torch
+        import diffusers
+        
+        lora = self.args.lora
+        if os.path.exists(lora):
+            # Local LoRA files: a retrained file at the same path is a new entry
+            stat = os.stat(lora)
+            lora = f"{os.path.abspath(lora)}:{stat.st_size}:{stat.st_mtime_ns}"
+        payload = json.dumps([model_name, lora, self.args.lora_scale, str(self.dtype),
+                              torch.__version__, diffusers.__version__])
+        return FUSED_LORA_DIR / hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def load_fused_lora_components(self, model_name: str) -> Dict[str, Any]:
+        """Components fused by an earlier --fuse-lora run ({} if there are none)"""
+        import importlib
+        
+        cache_dir = self.fused_lora_dir(model_name)
+        if not (cache_dir / FUSED_LORA_MARKER).exists():
+            return {}
+        
+        try:
+            with open(cache_dir / FUSED_LORA_MARKER) as f:
+                classes = json.load(f)["components"]
+            components = {}
+            for name, class_path in classes.items():
+                module_name, class_name = class_path.rsplit(".", 1)
+                component_class = getattr(importlib.import_module(module_name), class_name)
+                components[name] = component_class.from_pretrained(cache_dir / name, torch_dtype=self.dtype)
+                components[name] = components[name].to(self.device)
+            return components
+        except Exception as e:
+            self.log_warning(f"Could not load fused LoRA components - fusing again: {e}")
+            return {}
+    
+    def fuse_lora_weights(self):
+        """Fuse the loaded LoRA into the components it patches and cache them on disk
+        
+        The fused pipeline runs plain linear and attention layers, with no
+        adapter work per step. Later runs load the cached components in
+        place of the base ones and skip LoRA loading altogether.
+        """
+        scale = self.args.lora_scale
+        components = list(self.pipeline.get_list_adapters())  # Only those the LoRA has weights for
+        print(f"  → Fusing LoRA at scale {scale:g} into {', '.join(components)}")
+        self.pipeline.fuse_lora(components=components, lora_scale=scale)
+        self.pipeline.unload_lora_weights()  # Drops the adapter layers; the fused weights stay
+        
+        cache_dir = self.fused_lora_dir(self.pipeline_key.model)
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            classes = {}
+            for name in components:
+                module = getattr(self.pipeline, name)
+                module.save_pretrained(cache_dir / name, safe_serialization=True)
+                classes[name] = f"{type(module).__module__}.{type(module).__name__}"
+            # Written last: marks the cache entry complete
+            with open(cache_dir / FUSED_LORA_MARKER, 'w') as f:
+                json.dump({"model": self.pipeline_key.model, "lora": self.args.lora, "scale": scale,
+                           "dtype": str(self.dtype), "components": classes}, f, indent=2)
+            print(f"  → Cached fused components: {cache_dir}")
+        except Exception as e:
+            self.log_warning(f"Could not cache fused LoRA components: {e}")
+        
+        self.metadata["lora_fusion"] = {"scale": scale, "cache": "miss", "components": components}
+    
+    def lora_identity(self, with_fusion: bool = False) -> Optional[str]:
+        """The LoRA as it shapes outputs: its name, plus the scale when that isn't 1"""
+        lora = self.args.lora
+        if lora and self.args.lora_scale != 1.0:
+            lora = f"{lora}@{self.args.lora_scale:g}"
+        if lora and with_fusion and self.lora_fused:
+            lora += "+fused"
+        return lora
+    
+    def keep_resident(self):
+        """Keep the base pipeline loaded for later requests (daemon mode)"""
+        if self.pipeline_cache is None or self.pipeline_from_cache:
+            return
+        if self.metadata.get("lora") == "failed":
+            return  # Cache key promises a LoRA this pipeline doesn't have
+        self.pipeline_cache.put(self.pipeline_key, self.pipeline, in_use=self.held_pipelines())
+    
+    def held_pipelines(self):
+        """Pipelines this run still uses - resident copies of these can't be evicted"""
+        return [self.pipeline, self.refiner_pipeline]
+    
+    def release_base_pipeline(self):
+        """Unload the base pipeline, including any resident copy"""
+        if self.pipeline_cache is not None and self.pipeline_key is not None:
+            self.pipeline_cache.discard(self.pipeline_key)
+        if self.pipeline is not None:
+            del self.pipeline
+            self.pipeline = None
+    
+    def load_controlnet_model(self, controlnet_type: str):
+        """Load ControlNet weights for a control mode, reusing resident ones"""
+        from diffusers import ControlNetModel
+        
+        model_id = CONTROLNET_MODELS[controlnet_type]
+        key = pipeline_key(model_id, "ControlNetModel", self.dtype, controlnet=controlnet_type,
+                           device=self.device)
+        
+        controlnet = self.pipeline_cache.get(key) if self.pipeline_cache is not None else None
+        if controlnet is not None:
+            print(f"♻️  Reusing resident ControlNet: {controlnet_type}")
+            self.metadata["controlnet_cache"] = "hit"
+            return controlnet
+        
+        print(f"Loading ControlNet: {controlnet_type}")
+        controlnet = ControlNetModel.from_pretrained(model_id, torch_dtype=self.dtype)
+        controlnet = controlnet.to(self.device)
+        
+        if self.pipeline_cache is not None:
+            self.metadata["controlnet_cache"] = "miss"
+            self.pipeline_cache.put(key, controlnet, in_use=self.held_pipelines())
+        return controlnet
+    
+    def setup_controlnet(self):
+        """Setup ControlNet if specified"""
+        controlnet_type = None
+        controlnet_image = None
+        
+        if self.args.pose:
+            controlnet_type = "pose"
+            controlnet_image = self.args.pose
+        elif self.args.depth:
+            controlnet_type = "depth"
+            controlnet_image = self.args.depth
+        elif self.args.canny:
+            controlnet_type = "canny"
+            controlnet_image = self.args.canny
+        
+        if not controlnet_type:
+            return None
+        
+        # ControlNet models are SD 1.5 only - SDXL / SD 3.5 bases can't use them
+        if self.model_family != "sd15":
+            self.log_warning("ControlNet requires an SD 1.5 base model - falling back to base generation")
+            self.metadata["controlnet"] = "unsupported"
+            return None
+        
+        def load_controlnet_fn():
+            from diffusers import StableDiffusionControlNetPipeline
             from PIL import Image
             import cv2
             import numpy as np
             
-            # Map ControlNet types to model IDs
-            controlnet_models = {
-                "pose": "lllyasviel/control_v11p_sd15_openpose",
-                "depth": "lllyasviel/control_v11f1p_sd15_depth",
-                "canny": "lllyasviel/control_v11p_sd15_canny"
-            }
+            controlnet = self.load_controlnet_model(controlnet_type)
             
-            print(f"Loading ControlNet: {controlnet_type}")
-            controlnet = ControlNetModel.from_pretrained(
-                controlnet_models[controlnet_type],
-                torch_dtype=self.dtype
-            )
-            
-            # Rebuild pipeline with ControlNet
-            model_name = self.args.model if self.args.model else "Lykon/DreamShaper-8"
-            pipe = StableDiffusionControlNetPipeline.from_pretrained(
-                model_name,
-                controlnet=controlnet,
-                torch_dtype=self.dtype,
-                safety_checker=None,
-                requires_safety_checker=False
-            )
-            pipe = pipe.to(self.device)
-            pipe.enable_attention_slicing()
+            # Assemble the ControlNet pipeline from the resident base components
+            # (UNet, VAE, text encoder, LoRA) - only the ControlNet weights are new
+            pipe = StableDiffusionControlNetPipeline.from_pipe(self.pipeline, controlnet=controlnet)
             
             # Load and process control image
             control_img = Image.open(controlnet_image).convert("RGB")
@@ -500,8 +1755,203 @@ class ImageGenerator:
             self.metadata["controlnet"] = "failed"
             return None
     
-    def generate_images(self, control_image=None):
-        """Generate images with retry logic and memory management"""
+    def encode_prompt(self, prompt: str, negative_prompt: str) -> Optional[Dict[str, Any]]:
+        """Encode prompts through the embedding cache
+        
+        Returns the pipeline kwargs (prompt_embeds, negative_prompt_embeds and
+        pooled variants) on the pipeline's device, or None if encoding isn't
+        supported so the caller can fall back to raw strings.
+        """
+        import torch
+        
+        if (self.args.no_embedding_cache and not self.offload) or not hasattr(self.pipeline, "encode_prompt"):
+            self.metadata["prompt_embedding_cache"] = "disabled"
+            return None
+        
+        text_encoder = getattr(self.pipeline, "text_encoder", None) or getattr(self.pipeline, "text_encoder_2", None)
+        encoder_dtype = text_encoder.dtype if text_encoder is not None else self.dtype
+        if self.pipeline_key.quantize:
+            encoder_dtype = f"{encoder_dtype}+{self.pipeline_key.quantize}"  # int8 encoders embed differently
+        
+        cache = None if self.args.no_embedding_cache else get_prompt_embedding_cache()
+        if cache is not None:
+            key = cache.make_key(self.pipeline_key.model, encoder_dtype, self.lora_identity(), prompt, negative_prompt)
+            embeds, tier = cache.get(key)
+        else:
+            embeds, tier = None, "disabled"  # Offload mode always encodes outside the pipeline
+        
+        if embeds is None:
+            start = time.time()
+            with torch.no_grad():
+                if self.offload:
+                    embeds = self.encode_prompt_staged(prompt, negative_prompt)
+                else:
+                    embeds = self._encode_prompt_uncached(self.pipeline, prompt, negative_prompt)
+            if cache is not None:
+                embeds = cache.put(key, embeds)
+            self.metadata["prompt_encode_time"] = time.time() - start
+        
+        self.metadata["prompt_embedding_cache"] = tier
+        return {name: tensor.to(self.device) for name, tensor in embeds.items()}
+    
+    def encode_prompt_staged(self, prompt: str, negative_prompt: str) -> Dict[str, Any]:
+        """Load the SD 3.5 text encoders on their own, encode, and free them again (offload mode)
+        
+        Peak memory is then the larger of the encoders and the transformer
+        rather than their sum. Cached prompts never load the encoders at all.
+        """
+        model_name = model_source(self.pipeline_key.model, self.dtype)[0]
+        
+        def load_encoders_fn():
+            print("  → Loading text encoders")
+            return self.load_sd3_components(model_name, transformer=None, vae=None)
+        
+        with self.span("load_text_encoders"):
+            encoders, success = self.retry_operation("Text Encoder Load", load_encoders_fn)
+        if not success:
+            raise RuntimeError("Failed to load the SD 3.5 text encoders")
+        
+        try:
+            if self.args.lora:
+                try:
+                    encoders.load_lora_weights(self.args.lora)
+                    if self.args.lora_scale != 1.0:
+                        encoders.set_adapters(encoders.get_active_adapters(),
+                                              adapter_weights=self.args.lora_scale)
+                except Exception as e:
+                    self.log_warning(f"LoRA not applied to the text encoders: {e}")
+            return self._encode_prompt_uncached(encoders, prompt, negative_prompt)
+        finally:
+            del encoders
+            cleanup_memory(aggressive=True)
+            print("  → Freed text encoders")
+    
+    def _encode_prompt_uncached(self, pipe, prompt: str, negative_prompt: str) -> Dict[str, Any]:
+        """Run a pipeline's text encoder(s) on a prompt pair"""
+        # Always encode the negative prompt: every pipeline here runs with guidance
+        if self.model_family == "sd15":
+            prompt_embeds, negative_embeds = pipe.encode_prompt(
+                prompt, self.device, 1, True, negative_prompt=negative_prompt
+            )
+            return {"prompt_embeds": prompt_embeds, "negative_prompt_embeds": negative_embeds}
+        
+        # SDXL and SD 3.5 also return pooled embeddings
+        extra_prompts = {"prompt_2": None, "prompt_3": None} if self.model_family == "sd3" else {}
+        prompt_embeds, negative_embeds, pooled, negative_pooled = pipe.encode_prompt(
+            prompt=prompt,
+            **extra_prompts,
+            device=self.device,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=True,
+            negative_prompt=negative_prompt
+        )
+        return {
+            "prompt_embeds": prompt_embeds,
+            "negative_prompt_embeds": negative_embeds,
+            "pooled_prompt_embeds": pooled,
+            "negative_pooled_prompt_embeds": negative_pooled
+        }
+    
+    def output_resolution(self):
+        """(width, height) the base pipeline generates at (--width/--height or the model default)"""
+        pipe = self.pipeline
+        sample_size = getattr(pipe, "default_sample_size", None) or pipe.unet.config.sample_size
+        size = sample_size * pipe.vae_scale_factor
+        return self.args.width or size, self.args.height or size
+    
+    def microbatch_size(self) -> int:
+        """Images per pipeline call, sized from free memory, model family and resolution"""
+        if self.args.batch_size:
+            return min(self.args.batch_size, self.args.n)
+        
+        width, height = self.output_resolution()
+        per_image_gb = GENERATE_GB_PER_MEGAPIXEL[self.model_family] * width * height / 1e6
+        
+        available_gb = available_memory_gb(self.device)
+        if available_gb is None:
+            return 1
+        spare_gb = available_gb - GENERATE_MIN_FREE_GB
+        return max(1, min(self.args.n, int(spare_gb / per_image_gb)))
+
+    def memory_in_use_gb(self) -> float:
+        """Memory generation draws from: VRAM on CUDA, process memory elsewhere"""
+        if self.device == "cuda":
+            return accelerator_allocated_gb(self.device)
+        mem_info = get_memory_info()
+        rss_gb = mem_info.get("process_rss_gb", 0.0)
+        return rss_gb + accelerator_allocated_gb(self.device)  # MPS allocations live outside RSS
+
+    def plan_memory(self, width: int, height: int, batch_size: int):
+        """Pick the fastest memory optimizations that fit in free memory and apply them"""
+        import torch
+        
+        pipe = self.pipeline
+        offloadable_gb = None
+        available_gb = available_memory_gb(self.device) or 0.0
+        if self.device == "cuda":
+            sizes = [estimate_pipeline_size_gb(component) for component in pipe.components.values()
+                     if isinstance(component, torch.nn.Module)]
+            offloadable_gb = sum(sizes) - max(sizes, default=0.0)
+            if getattr(pipe, "_all_hooks", None):
+                available_gb -= offloadable_gb  # Already offloaded - those weights come back without offload
+            torch.cuda.reset_peak_memory_stats()
+
+        required = []
+        if self.args.vae_tiling_threshold and max(width, height) >= self.args.vae_tiling_threshold:
+            required.append("vae_tiling")
+        if self.offload and offloadable_gb is not None:
+            required.append("model_offload")  # SD 3.5 offload mode keeps its offload hooks
+        # MPS runs attention unfused, so there slicing is what keeps it in memory
+        plan = plan_memory(self.model_family, width, height, batch_size, self.dtype,
+                           available_gb - GENERATE_MIN_FREE_GB, offloadable_gb, required,
+                           fused_attention=self.device != "mps")
+        apply_memory_plan(pipe, plan["options"], self.device)
+
+        in_use_gb = self.memory_in_use_gb()
+        plan["baseline_gb"] = round(in_use_gb, 3)
+        plan["predicted_peak_gb"] = round(in_use_gb + plan["predicted_gb"], 3)
+        plan["actual_peak_gb"] = None
+        self.metadata["memory_plan"] = plan
+        self.metadata["memory_optimizations"] = plan["plan"] + (",aggressive_cleanup" if self.is_sd3 else "")
+        self.metadata.setdefault("vae_tiling", {})["base"] = "vae_tiling" in plan["options"]
+
+        print(f"🧠 Memory plan: {plan['plan']} (needs ~{plan['predicted_gb']:.1f}GB of "
+              f"{available_gb:.1f}GB free for {batch_size} image(s) at {width}x{height})")
+        if not plan["fits"]:
+            self.log_warning(f"No memory plan fits in free memory - using the most frugal one ({plan['plan']})")
+
+    def record_memory_peak(self):
+        """Fill in the measured generation peak next to the planned one
+
+        Uses the memory sampler's generate_images peak; without the sampler,
+        the CUDA allocator peak or (a lower bound) memory in use after the batch.
+        """
+        import torch
+        
+        plan = self.metadata.get("memory_plan")
+        if plan is None:
+            return
+        peak = self.memory_sampler.stage_peak("generate_images") if self.memory_sampler is not None else None
+        if peak is not None:
+            if self.device == "cuda":
+                measured_gb = peak["accelerator_gb"]
+            else:
+                measured_gb = peak["rss_gb"] + peak["accelerator_gb"]
+        elif self.device == "cuda":
+            measured_gb = torch.cuda.max_memory_allocated() / (1024**3)
+        else:
+            measured_gb = self.memory_in_use_gb()
+        plan["actual_peak_gb"] = round(max(plan["actual_peak_gb"] or 0.0, measured_gb), 3)
+
+    def generate_batches(self, control_image=None):
+        """Generate images in memory-sized microbatches, yielding each batch as it finishes
+        
+        Every image gets its own generator seeded with seed + index, so the
+        images are identical whatever the microbatch size. A failing batch
+        (usually out of memory) is split in half instead of retried as-is.
+        """
+        import torch
+        
         prompt = self.args.prompt
         negative_prompt = self.args.negative_prompt or ""
         
@@ -524,31 +1974,105 @@ class ImageGenerator:
             cleanup_memory(aggressive=True)
             log_memory_status("Before generation")
         
-        # Set seed
-        generator = torch.Generator(device=self.device).manual_seed(self.args.seed)
+        # Skip the text encoders for prompts encoded before
+        try:
+            prompt_embeds = self.encode_prompt(prompt, negative_prompt)
+        except Exception as e:
+            if self.offload:
+                raise  # The offload-mode pipeline has no text encoders to fall back on
+            self.log_warning(f"Prompt embedding cache failed - encoding in the pipeline: {e}")
+            self.metadata["prompt_embedding_cache"] = "failed"
+            prompt_embeds = None
         
-        # Prepare generation kwargs
-        gen_kwargs = {
-            "prompt": prompt,
-            "negative_prompt": negative_prompt,
-            "num_inference_steps": self.args.steps,
-            "generator": generator,
-            "num_images_per_prompt": self.args.n
-        }
+        width, height = self.output_resolution()
+        self.metadata["resolution"] = [width, height]
         
-        if control_image:
-            gen_kwargs["image"] = control_image
-            gen_kwargs["controlnet_conditioning_scale"] = 1.0
+        batch_size = self.microbatch_size()
+        self.plan_memory(width, height, batch_size)
+        if self.args.compile:
+            self.setup_compile(width, height, batch_size)
         
-        def generate_fn():
-            print(f"Generating {self.args.n} image(s)...")
-            result = self.pipeline(**gen_kwargs)
-            return result.images
+        self.step_times = []
+        self.metadata["step_latencies"] = self.step_times  # Seconds per denoising step, per pipeline call
+        self.metadata["microbatches"] = []
+        position = 0
         
-        images, success = self.retry_operation("Image Generation", generate_fn)
+        while position < self.args.n:
+            count = min(batch_size, self.args.n - position)
+            seeds = [self.args.seed + position + i for i in range(count)]
+            
+            # Prepare generation kwargs
+            gen_kwargs = {
+                "num_inference_steps": self.args.steps,
+                "width": width,
+                "height": height,
+                "generator": [torch.Generator(device=self.device).manual_seed(seed) for seed in seeds]
+            }
+            
+            if prompt_embeds:
+                # Not every pipeline repeats precomputed embeddings per image - expand them here
+                gen_kwargs.update({name: torch.cat([tensor] * count) for name, tensor in prompt_embeds.items()})
+            else:
+                gen_kwargs["prompt"] = prompt
+                gen_kwargs["negative_prompt"] = negative_prompt
+                gen_kwargs["num_images_per_prompt"] = count
+            
+            if control_image:
+                gen_kwargs["image"] = control_image
+                gen_kwargs["controlnet_conditioning_scale"] = 1.0
+            
+            label = (f"image {position + 1}" if count == 1
+                     else f"images {position + 1}-{position + count}")
+            
+            def generate_fn():
+                print(f"Generating {label} of {self.args.n}...")
+                step_ends = [time.perf_counter()]
+                
+                def on_step_end(pipe, step, timestep, callback_kwargs):
+                    step_ends.append(time.perf_counter())
+                    return callback_kwargs
+                
+                result = self.pipeline(**gen_kwargs, callback_on_step_end=on_step_end)
+                if len(step_ends) > 1:
+                    self.metadata.setdefault("time_to_first_step", step_ends[1] - self.run_start)
+                self.step_times.append([round(end - begin, 5) for begin, end in zip(step_ends, step_ends[1:])])
+                return result.images
+            
+            start = time.time()
+            with self.span("generate_images", first_image=position + 1, images=count):
+                images, success = self.retry_operation(
+                    f"Image Generation ({label})", generate_fn,
+                    max_retries=1 if count > 1 else 3
+                )
+            elapsed = time.time() - start
+            
+            if not success:
+                if count > 1:
+                    batch_size = max(1, count // 2)
+                    print(f"🧹 Retrying with microbatch size {batch_size}")
+                    cleanup_memory(aggressive=True)
+                    continue
+                raise RuntimeError("Image generation failed after multiple retries")
+            
+            print(f"   {count} image(s) in {elapsed:.1f}s ({count / elapsed:.2f} images/s)")
+            self.metadata["microbatches"].append({
+                "first_image": position + 1,
+                "images": count,
+                "time": elapsed,
+                "images_per_second": count / elapsed
+            })
+            position += count
+            
+            # Images are saved as they stream out - keep their metadata current
+            self.record_memory_peak()
+            self.record_step_timing(width, height, self.metadata["microbatches"][0]["images"],
+                                    final=position >= self.args.n)
+            
+            yield images
         
-        if not success:
-            raise RuntimeError("Image generation failed after multiple retries")
+        plan = self.metadata["memory_plan"]
+        print(f"🧠 Memory plan {plan['plan']}: predicted peak {plan['predicted_peak_gb']:.2f}GB, "
+              f"actual {plan['actual_peak_gb']:.2f}GB")
         
         # Memory cleanup after generation
         if self.is_sd3:
@@ -557,198 +2081,581 @@ class ImageGenerator:
             log_memory_status("After generation")
         else:
             cleanup_memory(aggressive=False)
+    
+    def compile_key_parts(self, width: int, height: int, batch_size: int):
+        """What compiled graphs and step timings depend on
+        
+        The dtype is the family's default one; quantization (which switches
+        to float32) comes last so step timings can leave it out and compare
+        against the default run.
+        """
+        controlnet = next((mode for mode in CONTROLNET_MODELS if getattr(self.args, mode, None)), None)
+        return [self.pipeline_key.model, self.lora_identity(with_fusion=True), controlnet, self.args.refiner,
+                f"{width}x{height}", f"batch{batch_size}", resolve_dtype(self.device, self.model_family),
+                self.device, self.pipeline_key.quantize]
+    
+    def setup_compile(self, width: int, height: int, batch_size: int):
+        """Compile the base pipeline, seeding inductor with artifacts saved by earlier runs"""
+        import torch
+        
+        COMPILE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Inductor's FX graph cache defaults to /tmp - keep it with our other caches
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(COMPILE_CACHE_DIR / "inductor"))
+        
+        artifacts_path = compile_artifacts_path(*self.compile_key_parts(width, height, batch_size))
+        cache = "miss"
+        if artifacts_path.exists():
+            try:
+                torch.compiler.load_cache_artifacts(artifacts_path.read_bytes())
+                cache = "hit"
+            except Exception as e:
+                self.log_warning(f"Could not load compile cache: {e}")
+        self.compile_artifacts = artifacts_path if cache == "miss" else None
+        
+        compiled = compile_pipeline_modules(self.pipeline)
+        if compiled:
+            print(f"⚡ Compiling {', '.join(compiled)} (channels_last, compile cache {cache})")
+        self.metadata["compile"] = {"modules": compiled, "cache": cache}
+    
+    def save_compile_cache(self):
+        """Persist what this run compiled so later processes skip the compile"""
+        import torch
+        
+        if self.compile_artifacts is None:
+            return
+        try:
+            saved = torch.compiler.save_cache_artifacts()
+            if saved is not None:
+                self.compile_artifacts.write_bytes(saved[0])
+                print(f"⚡ Saved compile cache: {self.compile_artifacts.name}")
+        except Exception as e:
+            self.log_warning(f"Could not save compile cache: {e}")
+        self.compile_artifacts = None
+    
+    def record_step_timing(self, width: int, height: int, batch_size: int, final: bool = True):
+        """Record warm-up and steady-state step time, compared between eager and compiled runs
+        
+        The first step of the first call carries the compile (or cache load);
+        the median of the rest is the steady state. The final call of a run
+        also stores the step time for later comparisons - for eager runs only
+        once a compiled or quantized run of the configuration needs a baseline.
+        Either run of the pair reports the speedup, whichever comes second.
+        """
+        steps = [step for call in self.step_times for step in call]
+        if not steps:
+            return
+        
+        first_step = steps[0]
+        steady = statistics.median(steps[1:] or steps)
+        timing = {
+            "steps": len(steps),
+            "first_step_time": first_step,
+            "steady_step_time": steady,
+            "warmup_time": max(0.0, first_step - steady)
+        }
+        
+        key = "|".join(str(part) for part in self.compile_key_parts(width, height, batch_size)[:-1])
+        skipped = compile_errors(self.pipeline) if self.args.compile else {}
+        if skipped:
+            self.metadata["compile"]["skipped"] = skipped
+        # A denoiser that fell back to eager doesn't time the compiled mode
+        compiled = self.args.compile and not {"unet", "transformer"} & set(skipped)
+        mode = "+".join(filter(None, ["compiled" if compiled else None,
+                                      self.pipeline_key.quantize])) or "eager"
+        timing["mode"] = mode
+        recorded = load_step_times().get(key, {})
+        eager = recorded.get("eager")
+        if mode != "eager" and eager:
+            timing["eager_step_time"] = eager
+            timing["speedup"] = eager / steady
+        elif mode == "eager":
+            # This run is the baseline for the compiled/quantized runs recorded so far
+            speedups = {other: steady / step for other, step in recorded.items() if other != "eager"}
+            if speedups:
+                timing["speedups"] = speedups
+        
+        self.metadata["step_timing"] = timing
+        if not final:
+            return
         
+        if mode != "eager" or any(other != "eager" for other in recorded):
+            try:
+                save_step_time(key, mode, steady)
+            except OSError as e:
+                self.log_warning(f"Could not save step timing: {e}")
+        
+        if mode != "eager":
+            if "speedup" in timing:
+                speedup = f", {timing['speedup']:.2f}x vs eager"
+            else:
+                speedup = " (run once without it to measure the speedup)"
+            print(f"⚡ Warm-up {timing['warmup_time']:.1f}s, steady state {steady:.3f}s/step{speedup}")
+        elif "speedups" in timing:
+            speedups = ", ".join(f"{other} {speedup:.2f}x" for other, speedup in timing["speedups"].items())
+            print(f"⚡ Eager baseline {steady:.3f}s/step: {speedups}")
+    
+    def generate_images(self, control_image=None):
+        """Generate all images with retry logic and memory management"""
+        images = []
+        for batch in self.generate_batches(control_image):
+            images.extend(batch)
         return images
     
-    def upscale_image(self, image):
-        """Upscale image using simple PIL resize (SD upscaler has MPS issues)"""
+    def upscale_images(self, images):
+        """Upscale images with tiled, multi-threaded PIL LANCZOS (SD upscaler has MPS issues)"""
         if not self.args.upscale or self.args.upscale == 1:
-            return image
+            return images
         
         print(f"⚠️  Note: Using PIL upscaling instead of SD upscaler (MPS memory issues)")
-        print(f"   Upscaling {self.args.upscale}x with LANCZOS algorithm...")
+        print(f"   Upscaling {len(images)} image(s) {self.args.upscale}x with tiled LANCZOS...")
         
         def upscale_fn():
-            from PIL import Image
-            
-            # Get current size
-            width, height = image.size
-            
-            # Calculate new size
-            new_width = width * self.args.upscale
-            new_height = height * self.args.upscale
-            
-            print(f"   {width}x{height} → {new_width}x{new_height}")
-            
-            # Use high-quality LANCZOS resampling
-            upscaled = image.resize((new_width, new_height), Image.LANCZOS)
-            
-            return upscaled
+            width, height = images[0].size
+            print(f"   {width}x{height} → {width * self.args.upscale}x{height * self.args.upscale}")
+            return tiled_upscale(images, self.args.upscale)
         
-        result, success = self.retry_operation("Upscaling", upscale_fn, max_retries=1)
+        with self.span("upscale_image", images=len(images)):
+            result, success = self.retry_operation("Upscaling", upscale_fn, max_retries=1)
         
         if success:
             self.metadata["upscale"] = self.args.upscale
-            self.metadata["upscale_method"] = "PIL_LANCZOS"
+            self.metadata["upscale_method"] = "PIL_LANCZOS_TILED"
             return result
         else:
             self.log_warning(f"Upscaling failed - saving base resolution image")
             self.metadata["upscale"] = "failed"
-            return image
+            return images
     
-    def refine_image(self, image):
-        """Refine image using refiner model with memory management"""
-        if not self.args.refiner:
-            return image
+    def upscale_image(self, image):
+        """Upscale a single image"""
+        return self.upscale_images([image])[0]
+    
+    def refiner_dtype(self):
+        """Weight dtype of the refiner (by its own model family)"""
+        return resolve_dtype(self.device, "sdxl" if "xl" in self.args.refiner.lower() else "sd15")
+    
+    def refiner_key(self) -> PipelineKey:
+        """Cache key of the refiner pipeline"""
+        is_sdxl = "xl" in self.args.refiner.lower()
+        pipeline_class = "StableDiffusionXLImg2ImgPipeline" if is_sdxl else "StableDiffusionImg2ImgPipeline"
+        shared_from = self.pipeline_key.model if self.args.share_components and self.pipeline_key else None
+        return pipeline_key(self.args.refiner, pipeline_class, self.refiner_dtype(),
+                            shared_from=shared_from, device=self.device, compile=bool(self.args.compile))
+    
+    def shared_refiner_components(self, refiner_class) -> Dict[str, Any]:
+        """Base pipeline components the refiner can reuse instead of loading its own
+        
+        The VAE is shared when its latent channels match the refiner UNet's
+        input, and the text encoders (with their tokenizers) when they are the
+        same classes and their hidden sizes add up to the refiner UNet's
+        cross-attention width. Only the components that differ get loaded.
+        """
+        if not self.args.share_components or self.pipeline is None:
+            return {}
+        
+        from diffusers import UNet2DConditionModel
+        
+        base = self.pipeline
+        vae = getattr(base, "vae", None)
+        if vae is None or vae.dtype != self.refiner_dtype():
+            return {}  # e.g. SD 3.5 runs in bfloat16
+        
+        try:
+            model_index = refiner_class.load_config(self.args.refiner)
+            unet_config = UNet2DConditionModel.load_config(self.args.refiner, subfolder="unet")
+        except Exception as e:
+            self.log_warning(f"Could not inspect refiner for component sharing: {e}")
+            return {}
+        
+        shared = {}
+        if model_index.get("vae", [None, None])[1] and vae.config.latent_channels == unet_config["in_channels"]:
+            shared["vae"] = vae
+        
+        # LoRA weights patch the base text encoders - the refiner must not inherit them
+        encoder_names = [name for name in ("text_encoder", "text_encoder_2")
+                         if model_index.get(name, [None, None])[1]]
+        base_encoders = [getattr(base, name, None) for name in encoder_names]
+        if (encoder_names and not self.args.lora and all(base_encoders)
+                and all(type(encoder).__name__ == model_index[name][1]
+                        for name, encoder in zip(encoder_names, base_encoders))
+                and sum(encoder.config.hidden_size for encoder in base_encoders) == unet_config["cross_attention_dim"]):
+            for name, encoder in zip(encoder_names, base_encoders):
+                tokenizer_name = name.replace("text_encoder", "tokenizer")
+                shared[name] = encoder
+                shared[tokenizer_name] = getattr(base, tokenizer_name)
+        
+        return shared
+    
+    def load_refiner(self):
+        """Load the refiner once per run; every image reuses the same pipeline"""
+        import torch
+        
+        if self.refiner_pipeline is not None:
+            return self.refiner_pipeline
         
         # Unload main pipeline to free memory for refiner (especially for SD 3.5)
         if self.is_sd3:
             print("🧹 Unloading main pipeline to free memory for refiner...")
-            if self.pipeline is not None:
-                del self.pipeline
-                self.pipeline = None
+            self.release_base_pipeline()
             cleanup_memory(aggressive=True)
             log_memory_status("Before refiner load")
         
-        def refine_fn():
+        # Reuse a resident refiner (daemon / batch jobs)
+        refiner_key = self.refiner_key()
+        if self.pipeline_cache is not None:
+            cached = self.pipeline_cache.get(refiner_key)
+            if cached is not None:
+                print(f"♻️  Reusing resident refiner: {self.args.refiner}")
+                self.refiner_pipeline = cached
+                return cached
+            self.pipeline_cache.enforce_budget(in_use=self.held_pipelines())  # Make room before loading
+        
+        def load_refiner_fn():
             from diffusers import StableDiffusionImg2ImgPipeline, StableDiffusionXLImg2ImgPipeline
             
-            print(f"Refining with model: {self.args.refiner}")
+            print(f"Loading refiner: {self.args.refiner}")
             
             # Check if this is an SDXL refiner
             is_sdxl = "xl" in self.args.refiner.lower()
+            refiner_class = StableDiffusionXLImg2ImgPipeline if is_sdxl else StableDiffusionImg2ImgPipeline
+            refiner_dtype = self.refiner_dtype()
+            source, self.metadata["refiner_source"] = model_source(self.args.refiner, refiner_dtype)
+            from_snapshot = self.metadata["refiner_source"] == "snapshot"
+            if from_snapshot:
+                print(f"  → Using local snapshot: {source}")
+            
+            # Reuse compatible components of the loaded base pipeline
+            shared = self.shared_refiner_components(refiner_class)
+            if shared:
+                print(f"  → Sharing with base pipeline: {', '.join(sorted(shared))}")
+            self.metadata["refiner_shared_components"] = sorted(shared)
             
             if is_sdxl:
                 # Use SDXL pipeline for SDXL models
                 refiner = StableDiffusionXLImg2ImgPipeline.from_pretrained(
-                    self.args.refiner,
-                    torch_dtype=self.dtype,
-                    variant="fp16" if self.dtype == torch.float16 else None,
-                    low_cpu_mem_usage=True
+                    source,
+                    torch_dtype=refiner_dtype,
+                    variant="fp16" if refiner_dtype == torch.float16 and not from_snapshot else None,
+                    low_cpu_mem_usage=True,
+                    **shared
                 )
             else:
                 # Use standard pipeline for SD 1.5/2.x models
                 refiner = StableDiffusionImg2ImgPipeline.from_pretrained(
-                    self.args.refiner,
-                    torch_dtype=self.dtype,
+                    source,
+                    torch_dtype=refiner_dtype,
                     safety_checker=None,
                     requires_safety_checker=False,
-                    low_cpu_mem_usage=True
+                    use_safetensors=True if from_snapshot else None,
+                    low_cpu_mem_usage=True,
+                    **shared
                 )
             
-            refiner = refiner.to(self.device)
-            refiner.enable_attention_slicing()
-            
-            try:
-                refiner.enable_vae_slicing()
-            except:
-                pass
+            # Memory optimizations are planned per run in plan_refiner_memory()
+            return refiner.to(self.device)
+        
+        start = time.time()
+        with self.span("load_refiner"):
+            refiner, success = self.retry_operation("Refiner Load", load_refiner_fn)
+        self.refiner_timing["load_time"] += time.time() - start
+        
+        if not success:
+            return None
+        
+        self.refiner_timing["loads"] += 1
+        self.refiner_pipeline = refiner
+        if self.pipeline_cache is not None:
+            self.pipeline_cache.put(refiner_key, refiner, in_use=self.held_pipelines())
+        log_memory_status("After refiner load")
+        return refiner
+    
+    def release_refiner(self):
+        """Unload the refiner pipeline, including any resident copy"""
+        if self.pipeline_cache is not None and self.args.refiner:
+            self.pipeline_cache.discard(self.refiner_key())
+        if self.refiner_pipeline is not None:
+            del self.refiner_pipeline
+            self.refiner_pipeline = None
+            cleanup_memory(aggressive=self.is_sd3)
+    
+    def plan_refiner_memory(self, width: int, height: int, batch_size: int) -> List[str]:
+        """Pick the refiner's memory optimizations the way plan_memory() does for the base"""
+        family = "sdxl" if "xl" in self.args.refiner.lower() else "sd15"
+        required = []
+        if self.args.vae_tiling_threshold and max(width, height) >= self.args.vae_tiling_threshold:
+            required.append("vae_tiling")
+        available_gb = available_memory_gb(self.device) or 0.0
+        plan = plan_memory(family, width, height, batch_size, self.refiner_dtype(),
+                           available_gb - REFINER_MIN_FREE_GB, required=required,
+                           fused_attention=self.device != "mps")
+        self.metadata["refiner_memory_plan"] = plan
+        self.metadata.setdefault("vae_tiling", {})["refiner"] = "vae_tiling" in plan["options"]
+        print(f"🧠 Refiner memory plan: {plan['plan']} (needs ~{plan['predicted_gb']:.1f}GB of "
+              f"{available_gb:.1f}GB free for {batch_size} image(s) at {width}x{height})")
+        return plan["options"]
+    
+    def restore_base_memory_plan(self):
+        """Re-apply the base plan after refining
+        
+        With --share-components the refiner plan switches the slicing and
+        tiling of the VAE it shares with the base pipeline, and later
+        microbatches expect the base plan. Re-applying it is a no-op otherwise.
+        """
+        plan = self.metadata.get("memory_plan")
+        if plan is not None and self.pipeline is not None:
+            apply_memory_plan(self.pipeline, plan["options"], self.device)
+    
+    def refiner_memory_pressure(self) -> bool:
+        """Whether memory (VRAM on CUDA) is too tight to keep the refiner loaded between images"""
+        available_gb = available_memory_gb(self.device)
+        if available_gb is None:
+            return False
+        return available_gb < REFINER_MIN_FREE_GB
+    
+    def refine_batch_size(self, image_size) -> int:
+        """Number of images to refine per call, sized from available memory"""
+        if self.args.refine_batch:
+            return self.args.refine_batch
+        
+        width, height = image_size
+        megapixels = width * height / 1e6
+        family = "sdxl" if "xl" in self.args.refiner.lower() else "sd15"
+        per_image_gb = REFINE_GB_PER_MEGAPIXEL[family] * megapixels
+        
+        available_gb = available_memory_gb(self.device)
+        if available_gb is None:
+            return 1
+        spare_gb = available_gb - REFINER_MIN_FREE_GB
+        return max(1, int(spare_gb / per_image_gb))
+    
+    def refine_images(self, images, first_index: int = 0):
+        """Refine images in batches using the refiner model with memory management
+        
+        Each image keeps its own seed (seed + index) and prompt, so batching
+        doesn't change which noise a given image is refined with. first_index
+        is the zero-based index of images[0] within the run.
+        """
+        import torch
+        
+        if not self.args.refiner:
+            return images
+        
+        # Don't retry a refiner that already failed to load
+        if self.refiner_load_failed:
+            return images
+        
+        refiner = self.load_refiner()
+        if refiner is None:
+            self.refiner_load_failed = True
+            self.log_warning(f"Refiner loading failed - saving unrefined images")
+            self.metadata["refiner"] = "failed"
+            return images
+        
+        if self.args.compile:
+            compiled = compile_pipeline_modules(refiner)
+            if compiled:
+                print(f"⚡ Compiling refiner {', '.join(compiled)} (channels_last)")
+        batch_size = min(len(images), self.refine_batch_size(images[0].size))
+        refiner_options = self.plan_refiner_memory(*images[0].size, batch_size)
+        refined_images = []
+        any_failed = False
+        position = 0
+        
+        while position < len(images):
+            batch = images[position:position + batch_size]
+            first = first_index + position
+            seeds = [self.args.seed + first + i for i in range(len(batch))]
+            label = (f"image {first + 1}" if len(batch) == 1
+                     else f"images {first + 1}-{first + len(batch)}")
             
-            # Store refiner for later cleanup
-            self.refiner_pipeline = refiner
+            def refine_fn():
+                print(f"Refining {label} with model: {self.args.refiner}")
+                # Refiner may have been released under memory pressure
+                pipe = self.load_refiner()
+                if pipe is None:
+                    raise RuntimeError("Refiner could not be reloaded")
+                apply_memory_plan(pipe, refiner_options, self.device)  # Also covers a reloaded refiner
+                return pipe(
+                    prompt=[self.args.prompt] * len(batch),
+                    image=batch,
+                    strength=0.3,
+                    num_inference_steps=20,
+                    generator=[torch.Generator(device=self.device).manual_seed(seed) for seed in seeds]
+                ).images
             
-            refined = refiner(
-                prompt=self.args.prompt,
-                image=image,
-                strength=0.3,
-                num_inference_steps=20
-            ).images[0]
+            # A failing batch is usually out of memory: halve it instead of retrying as-is
+            start = time.time()
+            load_time = self.refiner_timing["load_time"]
+            with self.span("refine_image", first_image=first + 1, images=len(batch)):
+                result, success = self.retry_operation(
+                    f"Refinement ({label})", refine_fn,
+                    max_retries=1 if batch_size > 1 else 3
+                )
+            # Reloads inside refine_fn are already counted in load_time
+            reload_time = self.refiner_timing["load_time"] - load_time
+            self.refiner_timing["inference_time"] += time.time() - start - reload_time
             
-            # Cleanup refiner after use
-            if self.is_sd3:
-                del refiner
-                self.refiner_pipeline = None
+            if success:
+                refined_images.extend(result)
+                self.refiner_timing["images"] += len(result)
+                self.refiner_timing["batches"].append(len(result))
+                position += len(batch)
+            elif batch_size > 1:
+                batch_size = max(1, batch_size // 2)
+                print(f"🧹 Retrying with refiner batch size {batch_size}")
                 cleanup_memory(aggressive=True)
+                continue
+            else:
+                self.log_warning(f"Refinement failed for {label} - saving unrefined image")
+                refined_images.extend(batch)
+                any_failed = True
+                position += len(batch)
             
-            return refined
-        
-        result, success = self.retry_operation("Refinement", refine_fn)
+            # Only tear the refiner down mid-run when memory is tight
+            if position < len(images) and self.refiner_memory_pressure():
+                print("🧹 Low memory - unloading refiner until next batch")
+                self.release_refiner()
         
-        if success:
-            self.metadata["refiner"] = self.args.refiner
-            return result
-        else:
-            self.log_warning(f"Refinement failed - saving unrefined image")
-            self.metadata["refiner"] = "failed"
-            return image
+        self.restore_base_memory_plan()
+        self.metadata["refiner_timing"] = dict(self.refiner_timing)
+        self.metadata["refiner"] = "failed" if any_failed and not self.refiner_timing["images"] else self.args.refiner
+        return refined_images
     
-    def save_image(self, image, index: int, generation_time: float):
-        """Save image with metadata"""
+    def reserve_image_paths(self, index: int):
+        """Pick unused image and metadata paths for an output image"""
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f"output_{timestamp}_{index:03d}.png"
-        json_filename = f"output_{timestamp}_{index:03d}.json"
+        stem = f"output_{timestamp}_{index:03d}"
         
         output_dir = Path(self.args.output)
         output_dir.mkdir(parents=True, exist_ok=True)
         
-        image_path = output_dir / filename
-        json_path = output_dir / json_filename
-        
-        # Save image
-        image.save(image_path)
-        print(f"✓ Saved: {image_path}")
+        # Back-to-back runs (batch jobs, daemon) can finish within the same second
+        suffix = 1
+        while (output_dir / f"{stem}.png").exists():
+            suffix += 1
+            stem = f"output_{timestamp}_{index:03d}-{suffix}"
         
-        # Save metadata
-        metadata = self.metadata.copy()
+        return output_dir / f"{stem}.png", output_dir / f"{stem}.json"
+    
+    def image_metadata(self, index: int, generation_time: float, filename: str):
+        """Snapshot the run metadata for one image"""
+        metadata = deepcopy(self.metadata)
         metadata["generation_time"] = generation_time
         metadata["image_index"] = index
+        metadata["image_seed"] = self.args.seed + index - 1
         metadata["filename"] = filename
         
-        with open(json_path, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        stage_totals = {}
+        for span in metadata["spans"]:
+            stage_totals[span["stage"]] = stage_totals.get(span["stage"], 0.0) + span["duration"]
+        metadata["stage_totals"] = stage_totals
+        
+        if self.memory_sampler is not None:
+            metadata["memory"] = self.memory_sampler.summary()
+        return metadata
+    
+    def write_image(self, image, image_path: Path, json_path: Path, metadata: dict):
+        """Write an image and its metadata (safe to run on the writer thread)"""
+        with self.span("save_image", image_index=metadata["image_index"]):
+            image.save(image_path)
+            
+            with open(json_path, 'w') as f:
+                json.dump(metadata, f, indent=2)
+        
+        return image_path
+    
+    def save_image(self, image, index: int, generation_time: float, writer=None):
+        """Save image with metadata
+        
+        With a writer (ThreadPoolExecutor) the files are written in the
+        background and a future for the image path is returned instead.
+        """
+        image_path, json_path = self.reserve_image_paths(index)
+        metadata = self.image_metadata(index, generation_time, image_path.name)
         
+        if writer is not None:
+            return writer.submit(self.write_image, image, image_path, json_path, metadata)
+        self.write_image(image, image_path, json_path, metadata)
+        print(f"✓ Saved: {image_path}")
         return image_path
     
+    def wait_for_saves(self, pending, limit: int = 0):
+        """Wait on queued saves, oldest first, until at most limit remain"""
+        while len(pending) > limit:
+            image_path = pending.pop(0).result()
+            print(f"✓ Saved: {image_path}")
+            self.saved_paths.append(image_path)
+    
     def run(self):
         """Main execution flow with comprehensive memory management"""
         start_time = time.time()
+        self.run_start = time.perf_counter()
+        self.saved_paths = []
+        
+        if self.args.profile:
+            self.start_profiler()
+        
+        if self.args.memory_interval > 0:
+            self.memory_sampler = MemorySampler(self.device, self.args.memory_interval)
+            self.memory_sampler.start()
         
         try:
-            # Check available memory before starting (for SD 3.5)
-            if self.is_sd3 or (hasattr(self.args, 'use_sd3') and self.args.use_sd3):
-                mem_info = get_memory_info()
-                if "error" not in mem_info:
-                    available_gb = mem_info["system_available_gb"]
-                    if available_gb < 30:
-                        print(f"⚠️  WARNING: Low memory detected ({available_gb:.1f}GB available)")
-                        print(f"   SD 3.5 requires 36GB+ RAM. Generation may fail or be very slow.")
-                        print(f"   Consider using --quality 4k-ultra (SDXL) instead for better performance.")
-                        self.log_warning(f"Low memory: {available_gb:.1f}GB available (36GB+ recommended for SD 3.5)")
-            
-            # Load base pipeline
-            self.load_base_pipeline()
+            # Load base pipeline (checks memory first for SD 3.5 - see sd3_offload_enabled)
+            with self.span("load_base_pipeline"):
+                self.load_base_pipeline()
             
             # Apply LoRA if specified
             if self.args.lora:
-                self.apply_lora()
+                with self.span("apply_lora"):
+                    self.apply_lora()
                 cleanup_memory(aggressive=self.is_sd3)
             
+            self.keep_resident()
+            
             # Setup ControlNet if specified
-            control_image = self.setup_controlnet()
+            with self.span("setup_controlnet"):
+                control_image = self.setup_controlnet()
             if control_image is not None:
                 cleanup_memory(aggressive=self.is_sd3)
             
-            # Generate images
-            images = self.generate_images(control_image)
+            # Stream each microbatch through refine -> upscale -> save as it
+            # finishes, so only one microbatch of images is held at a time
+            batches = self.generate_batches(control_image)
+            if self.args.refiner and self.is_sd3:
+                # The SD3 base is unloaded to make room for the refiner - finish generating first
+                batches = [[image for batch in batches for image in batch]]
             
-            # Post-process each image
-            final_images = []
-            for i, image in enumerate(images):
-                print(f"\n📸 Processing image {i+1}/{len(images)}")
-                
-                # Refine
-                if self.args.refiner:
-                    image = self.refine_image(image)
-                    cleanup_memory(aggressive=self.is_sd3)
-                
-                # Upscale
-                if self.args.upscale and self.args.upscale > 1:
-                    image = self.upscale_image(image)
-                    cleanup_memory(aggressive=self.is_sd3)
+            pending = []
+            index = 0
+            with ThreadPoolExecutor(max_workers=SAVE_WORKERS) as writer:
+                for images in batches:
+                    if self.args.refiner:
+                        print(f"\n✨ Refining {len(images)} image(s)")
+                        images = self.refine_images(images, first_index=index)
+                        cleanup_memory(aggressive=self.is_sd3)
+                    
+                    # Upscale the whole microbatch at once - tiles of every image run in parallel
+                    if self.args.upscale and self.args.upscale > 1:
+                        label = (f"image {index + 1}" if len(images) == 1
+                                 else f"images {index + 1}-{index + len(images)}")
+                        print(f"\n📸 Upscaling {label} of {self.args.n}")
+                        images = self.upscale_images(images)
+                        cleanup_memory(aggressive=self.is_sd3)
+                    
+                    for image in images:
+                        index += 1
+                        
+                        # Hand off to the background writer, waiting if it falls behind
+                        self.wait_for_saves(pending, limit=SAVE_QUEUE_LIMIT - 1)
+                        pending.append(self.save_image(image, index, time.time() - start_time, writer))
+                    
+                    del images
                 
-                final_images.append(image)
+                self.wait_for_saves(pending)
             
-            # Final cleanup before saving
+            self.save_compile_cache()
+            
+            # Final cleanup
             if self.pipeline is not None:
                 del self.pipeline
                 self.pipeline = None
@@ -757,13 +2664,8 @@ class ImageGenerator:
                 self.refiner_pipeline = None
             cleanup_memory(aggressive=True)
             
-            # Save all images
             generation_time = time.time() - start_time
-            saved_paths = []
-            
-            for i, image in enumerate(final_images, 1):
-                path = self.save_image(image, i, generation_time)
-                saved_paths.append(path)
+            saved_paths = self.saved_paths
             
             # Log final memory state
             log_memory_status("Complete")
@@ -772,6 +2674,17 @@ class ImageGenerator:
             print(f"✓ Generation complete!")
             print(f"  Time: {generation_time:.2f}s")
             print(f"  Images: {len(saved_paths)}")
+            stage_totals = {}
+            for span in self.metadata["spans"]:
+                stage_totals[span["stage"]] = stage_totals.get(span["stage"], 0.0) + span["duration"]
+            print(f"  Stages: {', '.join(f'{stage} {seconds:.1f}s' for stage, seconds in stage_totals.items())}")
+            if "time_to_first_step" in self.metadata:
+                print(f"  Time to first step: {self.metadata['time_to_first_step']:.1f}s "
+                      f"(model from {self.metadata.get('model_source', 'hub')})")
+            if self.memory_sampler is not None:
+                stage_peaks = self.memory_sampler.summary()["stages"]
+                peak_stage = max(stage_peaks, key=lambda stage: stage_peaks[stage]["rss_gb"])
+                print(f"  Peak memory: {stage_peaks[peak_stage]['rss_gb']:.1f}GB RSS during {peak_stage}")
             if self.metadata["warnings"]:
                 print(f"  Warnings: {len(self.metadata['warnings'])}")
             if self.metadata["failures"]:
@@ -785,10 +2698,9 @@ class ImageGenerator:
             print(f"✗ FATAL ERROR: {str(e)}")
             print(f"{'='*60}")
             
-            # Emergency cleanup
+            # Emergency cleanup (a resident pipeline may be in a bad state)
             try:
-                if self.pipeline is not None:
-                    del self.pipeline
+                self.release_base_pipeline()
                 if self.refiner_pipeline is not None:
                     del self.refiner_pipeline
                 cleanup_memory(aggressive=True)
@@ -796,8 +2708,14 @@ class ImageGenerator:
                 pass
             
             return 1
+        
+        finally:
+            self.stop_profiler()
+            if self.memory_sampler is not None:
+                self.memory_sampler.stop()
 
-def main():
+def build_parser():
+    """Build the CLI argument parser (shared by the CLI and the daemon)"""
     parser = argparse.ArgumentParser(
         description="SD-Generate: Robust Text-to-Image Generation",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -825,7 +2743,7 @@ Examples:
     )
     
     # Core arguments
-    parser.add_argument("prompt", type=str, help="Text prompt for generation")
+    parser.add_argument("prompt", type=str, nargs="?", help="Text prompt for generation")
     
     # Pro mode - SD 3.5 Large Turbo (shortcut)
     parser.add_argument("--pro", action="store_true", 
@@ -835,12 +2753,20 @@ Examples:
     parser.add_argument("--quality", type=str, 
                        choices=["fast", "quality", "hd", "max", "ultra", "ultra-hd", "4k", "4k-ultra", "photorealistic", "ultra-realistic", "cinematic", "lcm"],
                        help="Quality preset (auto-configures model, refiner, upscaler, LoRA)")
+    parser.add_argument("--list-presets", action="store_true",
+                       help="List the quality presets and styles, then exit")
     
     parser.add_argument("--model", type=str, help="Override base model path")
     parser.add_argument("--output", type=str, default="./outputs", help="Output directory")
     parser.add_argument("--n", type=int, default=1, help="Number of images to generate")
     parser.add_argument("--steps", type=int, default=30, help="Number of inference steps")
-    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (image i uses seed + i)")
+    parser.add_argument("--batch-size", type=int, default=0,
+                       help="Images per pipeline call (default: sized from available memory)")
+    parser.add_argument("--width", type=int, help="Output width in pixels (default: model's native size)")
+    parser.add_argument("--height", type=int, help="Output height in pixels (default: model's native size)")
+    parser.add_argument("--vae-tiling-threshold", type=int, default=VAE_TILING_THRESHOLD,
+                       help=f"Tile VAE encode/decode at this many pixels on the long edge, 0 = never (default: {VAE_TILING_THRESHOLD})")
     parser.add_argument("--negative-prompt", type=str, help="Negative prompt")
     
     # Style
@@ -849,6 +2775,10 @@ Examples:
     
     # LoRA
     parser.add_argument("--lora", type=str, help="Path to LoRA weights (.safetensors)")
+    parser.add_argument("--lora-scale", type=float, default=1.0,
+                       help="Strength of the LoRA (default: 1.0)")
+    parser.add_argument("--fuse-lora", action="store_true",
+                       help="Fuse the LoRA into the model weights and cache the result - later runs skip LoRA loading")
     
     # ControlNet
     parser.add_argument("--pose", type=str, help="Path to pose control image")
@@ -858,9 +2788,58 @@ Examples:
     # Post-processing
     parser.add_argument("--upscale", type=int, choices=[2, 4], help="Upscale factor (uses stabilityai/stable-diffusion-x4-upscaler)")
     parser.add_argument("--refiner", type=str, help="Refiner model name (e.g., 'runwayml/stable-diffusion-v1-5' for SD1.5 compatible)")
+    parser.add_argument("--share-components", action="store_true",
+                       help="Build the refiner from the base pipeline's VAE/text encoders where compatible")
+    parser.add_argument("--refine-batch", type=int, default=0,
+                       help="Images per refiner call (default: sized from available memory)")
+    
+    # Backend
+    parser.add_argument("--device", choices=DEVICE_CHOICES, default="auto",
+                       help="Torch device (default: auto - CUDA, then MPS, then CPU)")
+    parser.add_argument("--threads", type=int, default=0,
+                       help="CPU intra-op threads (default: PyTorch's choice)")
+    parser.add_argument("--quantize", choices=["int8"],
+                       help="Dynamic int8 quantization of text encoders and UNet (CPU only, cached on disk)")
+    parser.add_argument("--offload", choices=["auto", "on", "off"], default="auto",
+                       help=f"Load SD 3.5 in stages, freeing the text encoders before the transformer loads "
+                            f"(auto: below {SD3_OFFLOAD_BELOW_GB:.0f}GB available)")
+    parser.add_argument("--memory-interval", type=float, default=MEMORY_SAMPLE_INTERVAL,
+                       help=f"Seconds between memory samples, 0 = off (default: {MEMORY_SAMPLE_INTERVAL})")
+    parser.add_argument("--profile", action="store_true",
+                       help="Export a torch profiler Chrome trace of the run to the output directory")
+    parser.add_argument("--compile", action="store_true",
+                       help="channels_last + torch.compile the UNet/VAE (compile cache persists across runs)")
+    
+    parser.add_argument("--no-embedding-cache", action="store_true",
+                       help="Encode prompts on every run instead of using the embedding cache")
     
-    args = parser.parse_args()
+    # Batch jobs
+    parser.add_argument("--jobs", type=str,
+                       help="JSONL file of jobs (one JSON object of CLI options per line)")
     
+    parser.add_argument("--warm-cache", nargs="*", metavar="PRESET",
+                       help="Save the models of these quality presets (default: all) as local snapshots "
+                            "in their target dtype, then exit")
+    
+    # Warm-pipeline daemon
+    parser.add_argument("--serve", action="store_true",
+                       help="Run a daemon that keeps loaded pipelines resident between requests")
+    parser.add_argument("--stop-daemon", action="store_true", help="Shut down a running daemon")
+    parser.add_argument("--no-daemon", action="store_true",
+                       help="Always generate in-process, even if a daemon is running")
+    parser.add_argument("--socket", type=str, default=DAEMON_SOCKET,
+                       help=f"Daemon socket path (default: {DAEMON_SOCKET})")
+    
+    # Pipeline cache (daemon and batch jobs)
+    parser.add_argument("--cache-budget-gb", type=float, default=0,
+                       help="Max GB of pipelines to keep loaded (default: no fixed budget)")
+    parser.add_argument("--cache-min-free-gb", type=float, default=CACHE_MIN_FREE_GB,
+                       help=f"Evict cached pipelines when free memory drops below this (default: {CACHE_MIN_FREE_GB})")
+    
+    return parser
+
+def prepare_args(args, argv: List[str]):
+    """Apply CLI shortcuts (--pro) and record which options were explicit"""
     # Handle --pro flag (shortcut for SD 3.5 Large Turbo)
     if args.pro:
         if not args.model:
@@ -883,17 +2862,434 @@ Examples:
     
     # Track if user explicitly set steps (to avoid overriding with preset)
     # Check if steps was explicitly passed by user
-    import sys
-    args.steps_override = '--steps' in sys.argv
+    args.steps_override = '--steps' in argv
+
+def run_request(args, argv: List[str], pipeline_cache: Optional[PipelineCache] = None):
+    """Run one generation request (in-process or inside the daemon)"""
+    if args.jobs:
+        return run_jobs(args, argv, pipeline_cache)
     
-    # Validation
-    if args.n < 1:
-        print("Error: --n must be at least 1")
-        return 1
+    prepare_args(args, argv)
     
     # Create generator and run
-    generator = ImageGenerator(args)
+    generator = ImageGenerator(args, pipeline_cache=pipeline_cache)
     return generator.run()
 
+# Options that only make sense on the command line, not inside a jobs file
+JOB_FORBIDDEN_KEYS = {"jobs", "serve", "stop_daemon", "no_daemon", "socket", "warm_cache", "list_presets"}
+
+def validate_args(args, check_device: bool = False) -> Optional[str]:
+    """Check option values argparse can't; returns an error message or None
+    
+    check_device also checks that --device is usable, which imports torch.
+    """
+    if args.n < 1:
+        return "--n must be at least 1"
+    if args.batch_size < 0:
+        return "--batch-size must be 0 (auto) or more"
+    if args.refine_batch < 0:
+        return "--refine-batch must be 0 (auto) or more"
+    for name in ("width", "height"):
+        value = getattr(args, name)
+        if value is not None and (value <= 0 or value % 16):
+            return f"--{name} must be a positive multiple of 16"
+    if args.vae_tiling_threshold < 0:
+        return "--vae-tiling-threshold must be 0 (never) or more"
+    if args.memory_interval < 0:
+        return "--memory-interval must be 0 (off) or more"
+    if args.threads < 0:
+        return "--threads must be 0 (default) or more"
+    if getattr(args, "quantize", None) and importlib.util.find_spec("torchao") is None:
+        return f"--quantize {args.quantize} needs torchao: pip install torchao"
+    if check_device:
+        try:
+            resolve_device(args.device)
+        except RuntimeError as e:
+            return str(e)
+    return None
+
+def job_to_argv(job: Dict[str, Any]) -> List[str]:
+    """Convert one jobs-file entry into CLI arguments"""
+    if not isinstance(job, dict):
+        raise ValueError("job must be a JSON object")
+    job = dict(job)
+    prompt = job.pop("prompt", None)
+    if not prompt:
+        raise ValueError("job has no prompt")
+    
+    argv = [str(prompt)]
+    for key, value in job.items():
+        dest = key.replace("-", "_")
+        if dest in JOB_FORBIDDEN_KEYS:
+            raise ValueError(f"'{key}' is not allowed in a jobs file")
+        if value is None or value is False:
+            continue
+        argv.append("--" + dest.replace("_", "-"))
+        if value is not True:
+            argv.append(str(value))
+    return argv
+
+def strip_jobs_option(argv: List[str]) -> List[str]:
+    """Remove --jobs FILE from argv, leaving options shared by every job"""
+    shared = []
+    skip_next = False
+    for arg in argv:
+        if skip_next:
+            skip_next = False
+        elif arg == "--jobs":
+            skip_next = True
+        elif not arg.startswith("--jobs="):
+            shared.append(arg)
+    return shared
+
+def run_jobs(args, argv: List[str], pipeline_cache: Optional[PipelineCache] = None):
+    """Run every job in a JSONL file, grouped so each pipeline loads only once
+    
+    Each line holds the same fields as the CLI options. Options given on the
+    command line alongside --jobs apply to every job unless the job overrides
+    them. Jobs are reordered by (model, LoRA, refiner) and the other options
+    that key a pipeline (LoRA scale, --fuse-lora, --quantize, --compile, ...)
+    so each configuration is loaded once and drained before switching to the next.
+    """
+    parser = build_parser()
+    shared_argv = strip_jobs_option(argv)
+    start_time = time.time()
+    
+    jobs = []
+    results = []
+    with open(args.jobs) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                job_argv = job_to_argv(json.loads(line))
+                full_argv = job_argv[:1] + shared_argv + job_argv[1:]
+                job_args = parser.parse_args(full_argv)
+                error = validate_args(job_args, check_device=True)
+                if error:
+                    raise ValueError(error)
+            except (ValueError, SystemExit) as e:
+                error = str(e) if isinstance(e, ValueError) else "invalid arguments"
+                print(f"✗ Skipping job on line {line_number}: {error}")
+                results.append({"line": line_number, "exit_code": 1, "error": error})
+                continue
+            jobs.append({
+                "line": line_number,
+                "argv": full_argv,
+                "args": job_args,
+                "config": resolve_pipeline_config(job_args),
+                "settings": resolve_pipeline_settings(job_args)
+            })
+    
+    # Model affinity: run all jobs for one pipeline configuration back to back
+    jobs.sort(key=lambda job: tuple(part or "" for part in job["config"]) + job["settings"])
+    configurations = len({(job["config"], job["settings"]) for job in jobs})
+    
+    print(f"📋 {len(jobs)} job(s) across {configurations} pipeline configuration(s)")
+    
+    owns_cache = pipeline_cache is None
+    if owns_cache:
+        pipeline_cache = PipelineCache(args.cache_budget_gb, args.cache_min_free_gb)
+    
+    current_config = None
+    for position, job in enumerate(jobs, 1):
+        model, lora, refiner = job["config"]
+        compiled = bool(job["args"].compile)
+        if (job["config"], job["settings"]) != current_config:
+            # Previous configuration is drained - release what the next one doesn't use
+            pipeline_cache.retain(
+                lambda key: (key.model == model and key.lora == lora and key.compile == compiled)
+                or (refiner is not None and key.model == refiner and key.lora is None and key.compile == compiled)
+                or key.pipeline_class == "ControlNetModel"  # Cheap to keep, any SD 1.5 base can use it
+            )
+            current_config = (job["config"], job["settings"])
+        
+        print(f"\n{'#'*60}")
+        print(f"# Job {position}/{len(jobs)} (line {job['line']}): {job['args'].prompt}")
+        print(f"{'#'*60}")
+        
+        job_start = time.time()
+        try:
+            prepare_args(job["args"], job["argv"])
+            generator = ImageGenerator(job["args"], pipeline_cache=pipeline_cache)
+            exit_code = generator.run()
+        except Exception as e:
+            print(f"✗ Job on line {job['line']} failed: {e}")
+            generator = None
+            exit_code = 1
+        
+        result = {
+            "line": job["line"],
+            "prompt": job["args"].prompt,
+            "model": model,
+            "lora": lora,
+            "refiner": refiner,
+            "exit_code": exit_code,
+            "time": time.time() - job_start
+        }
+        if generator is not None:
+            result["images"] = [str(path) for path in generator.saved_paths]
+            for key in ("pipeline_cache", "refiner_timing"):
+                if key in generator.metadata:
+                    result[key] = generator.metadata[key]
+        results.append(result)
+    
+    if owns_cache:
+        pipeline_cache.clear()
+    
+    # One summary for the whole jobs file
+    failed = sum(1 for result in results if result["exit_code"] != 0)
+    total_time = time.time() - start_time
+    summary = {
+        "jobs_file": str(Path(args.jobs).resolve()),
+        "total_jobs": len(results),
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "configurations": configurations,
+        "total_time": total_time,
+        "jobs": results
+    }
+    
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    summary_path = output_dir / f"jobs_summary_{timestamp}.json"
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    
+    print(f"\n{'='*60}")
+    print(f"✓ Jobs complete!")
+    print(f"  Time: {total_time:.2f}s")
+    print(f"  Jobs: {len(results) - failed}/{len(results)} succeeded")
+    print(f"  Summary: {summary_path}")
+    print(f"{'='*60}")
+    
+    return 0 if failed == 0 else 1
+
+class _DaemonOutput:
+    """File-like object that streams daemon output back to the client"""
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self.connected = True
+    
+    def write(self, data):
+        if self.connected and data:
+            message = json.dumps({"type": "output", "data": data}) + "\n"
+            try:
+                self.conn.sendall(message.encode("utf-8"))
+            except OSError:
+                # Client went away - keep generating, just stop streaming
+                self.connected = False
+        return len(data)
+    
+    def flush(self):
+        pass
+
+def _read_message(conn):
+    """Read one newline-delimited JSON message from a socket"""
+    buffer = b""
+    while not buffer.endswith(b"\n"):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        buffer += chunk
+    return json.loads(buffer.decode("utf-8")) if buffer.strip() else None
+
+def serve_daemon(socket_path: str, budget_gb: float = 0, min_free_gb: float = CACHE_MIN_FREE_GB):
+    """Serve generation requests over a Unix socket, keeping pipelines warm"""
+    import socket
+    from contextlib import redirect_stdout, redirect_stderr
+    
+    socket_file = Path(socket_path)
+    socket_file.parent.mkdir(parents=True, exist_ok=True)
+    
+    if socket_file.exists():
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(socket_file))
+            print(f"Error: a daemon is already running on {socket_file}")
+            return 1
+        except OSError:
+            socket_file.unlink()  # Stale socket from a daemon that died
+        finally:
+            probe.close()
+    
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(socket_file))
+    server.listen(8)
+    
+    parser = build_parser()
+    pipeline_cache = PipelineCache(budget_gb, min_free_gb)
+    
+    print(f"🔥 SD-Generate daemon listening on {socket_file}")
+    print("   Pipelines stay loaded between requests (Ctrl+C or --stop-daemon to exit)")
+    if budget_gb:
+        print(f"   Pipeline cache budget: {budget_gb:.1f}GB (keeping {min_free_gb:.1f}GB free)")
+    
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    request = _read_message(conn)
+                except (OSError, ValueError) as e:
+                    print(f"⚠️  Bad daemon request: {e}")
+                    continue
+                if not request:
+                    continue
+                
+                if request.get("command") == "shutdown":
+                    conn.sendall(b'{"type": "result", "exit_code": 0}\n')
+                    break
+                
+                argv = request.get("argv", [])
+                print(f"→ Request: {' '.join(argv)}")
+                
+                output = _DaemonOutput(conn)
+                previous_cwd = os.getcwd()
+                exit_code = 1
+                try:
+                    # Resolve relative paths (output, LoRA, control images) like the client would
+                    os.chdir(request.get("cwd", previous_cwd))
+                    with redirect_stdout(output), redirect_stderr(output):
+                        try:
+                            exit_code = run_request(parser.parse_args(argv), argv, pipeline_cache)
+                        except SystemExit as e:
+                            exit_code = e.code if isinstance(e.code, int) else 1
+                        except Exception as e:
+                            print(f"✗ FATAL ERROR: {e}")
+                finally:
+                    os.chdir(previous_cwd)
+                
+                print(f"← Finished with exit code {exit_code}")
+                if output.connected:
+                    try:
+                        conn.sendall((json.dumps({"type": "result", "exit_code": exit_code}) + "\n").encode("utf-8"))
+                    except OSError:
+                        pass
+    except KeyboardInterrupt:
+        print("\nShutting down daemon...")
+    finally:
+        server.close()
+        if socket_file.exists():
+            socket_file.unlink()
+        pipeline_cache.clear()
+    
+    return 0
+
+def send_to_daemon(socket_path: str, request: Dict[str, Any]) -> Optional[int]:
+    """Hand a request to a running daemon
+    
+    Returns the request's exit code, or None when no daemon is reachable
+    (the caller then falls back to in-process generation).
+    """
+    import socket
+    
+    if not os.path.exists(socket_path):
+        return None
+    
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except OSError:
+        conn.close()
+        return None
+    
+    with conn:
+        conn.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        buffer = b""
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                print("✗ Lost connection to daemon")
+                return 1
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                message = json.loads(line.decode("utf-8"))
+                if message["type"] == "output":
+                    sys.stdout.write(message["data"])
+                    sys.stdout.flush()
+                elif message["type"] == "result":
+                    return message["exit_code"]
+
+def list_presets():
+    """Print the quality presets and styles (no torch import needed)"""
+    print("Quality presets (--quality):")
+    for name, preset in QUALITY_PRESETS.items():
+        print(f"  {name:<16} {preset['description']}")
+        details = [f"model {preset['model']}", f"{preset['steps']} steps"]
+        if preset.get("refiner"):
+            details.append(f"refiner {preset['refiner']}")
+        if preset.get("upscale"):
+            details.append(f"{preset['upscale']}x upscale")
+        if preset.get("lora"):
+            details.append(f"LoRA {preset['lora']}")
+        if preset.get("use_sd3"):
+            details.append("SD 3.5 via --pro")
+        print(f"  {'':<16} {', '.join(details)}")
+    
+    print("\nStyles (--style):")
+    for name, style in STYLES.items():
+        print(f"  {name:<16} {style['prompt_suffix'].lstrip(', ')}")
+
+def main():
+    # Everything up to the in-process run (parsing, validation, the daemon
+    # client) stays free of torch/diffusers imports so the CLI starts fast
+    parser = build_parser()
+    argv = sys.argv[1:]
+    args = parser.parse_args(argv)
+    
+    if args.list_presets:
+        list_presets()
+        return 0
+    
+    if args.warm_cache is not None:
+        unknown = [name for name in args.warm_cache if name not in QUALITY_PRESETS]
+        if unknown:
+            parser.error(f"unknown preset(s) for --warm-cache: {', '.join(unknown)}")
+        return warm_cache(args.warm_cache or list(QUALITY_PRESETS), args.device)
+    
+    if args.serve:
+        return serve_daemon(args.socket, args.cache_budget_gb, args.cache_min_free_gb)
+    
+    if args.stop_daemon:
+        if send_to_daemon(args.socket, {"command": "shutdown"}) is None:
+            print(f"No daemon running on {args.socket}")
+            return 1
+        print("✓ Daemon stopped")
+        return 0
+    
+    # Validation
+    if args.jobs:
+        if args.prompt:
+            parser.error("a prompt can't be combined with --jobs (put prompts in the jobs file)")
+        if not os.path.isfile(args.jobs):
+            print(f"Error: jobs file not found: {args.jobs}")
+            return 1
+    elif not args.prompt:
+        parser.error("the following arguments are required: prompt")
+    
+    error = validate_args(args)
+    if error:
+        print(f"Error: {error}")
+        return 1
+    
+    # Hand off to a warm daemon if one is running, otherwise generate in-process
+    if not args.no_daemon:
+        exit_code = send_to_daemon(args.socket, {"argv": argv, "cwd": os.getcwd()})
+        if exit_code is not None:
+            return exit_code
+    
+    # Checking the device imports torch - the daemon checks its own
+    error = validate_args(args, check_device=True)
+    if error:
+        print(f"Error: {error}")
+        return 1
+    
+    return run_request(args, argv)
+
 if __name__ == "__main__":
     sys.exit(main())
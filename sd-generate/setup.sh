@@ -89,7 +89,7 @@ echo ""
 
 # Step 4: Install core dependencies
 echo -e "${YELLOW}Step 4:${NC} Installing diffusers and dependencies..."
-DEPENDENCIES="diffusers transformers accelerate safetensors pillow sentencepiece opencv-python datasets huggingface_hub peft protobuf psutil"
+DEPENDENCIES="diffusers transformers accelerate safetensors pillow sentencepiece opencv-python datasets huggingface_hub peft protobuf psutil torchao"
 retry_command "pip install $DEPENDENCIES" "Dependencies installation" || exit 1
 echo -e "${GREEN}✓${NC} All dependencies installed (including SD 3.5 + memory management)"
 echo ""
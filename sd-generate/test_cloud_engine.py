@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Test the generate-cloud.py request engine against fake_inference_server.py
+
+Checks that concurrent requests overlap, that 429 and 503 responses are
+retried until every image is saved, that --rate-limit spaces requests out,
+that other errors fail without retries, and that each image gets its own
+seed and repeats come from the response cache. No network or HF token needed.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+from fake_inference_server import start_server
+
+HERE = Path(__file__).resolve().parent
+GENERATE_CLOUD = str(HERE / "generate-cloud.py")
+
+def run_cloud(url: str, output: str, *extra, home: str = None):
+    """Run generate-cloud.py against url; returns (exit code, seconds, saved images)
+
+    Without home (where the response cache lives) the cache is off.
+    """
+    command = [sys.executable, GENERATE_CLOUD, "a cat", "--n", "8", "--endpoint", url, "--output", output, *extra]
+    env = dict(os.environ, HF_TOKEN="")
+    if home:
+        env["HOME"] = home
+    else:
+        command.append("--no-cache")
+    start = time.perf_counter()
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode not in (0, 1):
+        print(result.stdout + result.stderr)
+    return result.returncode, elapsed, sorted(Path(output).glob("*.png"))
+
+def stats(server):
+    with urllib.request.urlopen(f"{server.url}/stats") as response:
+        return json.load(response)
+
+def check(name: str, condition: bool, detail: str):
+    print(f"{'✓' if condition else '✗'} {name}: {detail}")
+    return condition
+
+def main():
+    print("="*70)
+    print("  generate-cloud.py request engine")
+    print("="*70)
+    print()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # Concurrency: 8 images at 0.5s each overlap instead of queueing
+        server = start_server(latency=0.5, jitter=0)
+        _, sequential, _ = run_cloud(server.url, f"{tmp}/sequential", "--concurrency", "1")
+        code, concurrent, images = run_cloud(server.url, f"{tmp}/concurrent", "--concurrency", "4")
+        server_stats = stats(server)
+        server.shutdown()
+        results.append(check("concurrency", code == 0 and len(images) == 8 and concurrent < sequential / 2.5,
+                             f"--concurrency 1 {sequential:.2f}s, 4 {concurrent:.2f}s, "
+                             f"{server_stats['max_in_flight']} in flight"))
+
+        # Throttling: the server takes 2 at a time and answers 429 beyond that
+        server = start_server(latency=0.3, jitter=0, max_in_flight=2, retry_after=0.2)
+        code, elapsed, images = run_cloud(server.url, f"{tmp}/throttled", "--concurrency", "4",
+                                          "--max-retries", "10")
+        server_stats = stats(server)
+        server.shutdown()
+        results.append(check("429 retries", code == 0 and len(images) == 8 and server_stats["throttled"] > 0
+                             and server_stats["max_in_flight"] <= 2,
+                             f"{len(images)}/8 saved, {server_stats['throttled']} throttled, {elapsed:.2f}s"))
+
+        # Server errors: 30% of requests fail with 503
+        server = start_server(latency=0.1, jitter=0, error_rate=0.3)
+        code, elapsed, images = run_cloud(server.url, f"{tmp}/errors", "--concurrency", "4", "--max-retries", "10")
+        server_stats = stats(server)
+        server.shutdown()
+        results.append(check("5xx retries", code == 0 and len(images) == 8,
+                             f"{len(images)}/8 saved, {server_stats['errors']} errors, {elapsed:.2f}s"))
+
+        # Client rate limit: 3.5 requests/s stays under a server limit of 4/s
+        server = start_server(latency=0.05, jitter=0, rate_limit=4)
+        code, elapsed, images = run_cloud(server.url, f"{tmp}/rate", "--concurrency", "8", "--rate-limit", "3.5")
+        server_stats = stats(server)
+        server.shutdown()
+        results.append(check("rate limit", code == 0 and len(images) == 8 and server_stats["throttled"] == 0
+                             and elapsed >= 7 / 3.5,
+                             f"{len(images)}/8 saved in {elapsed:.2f}s, {server_stats['throttled']} throttled"))
+
+        # Client errors are not retried
+        server = start_server(latency=0, jitter=0, error_rate=1.0, error_status=400)
+        code, elapsed, images = run_cloud(server.url, f"{tmp}/invalid", "--concurrency", "4")
+        server_stats = stats(server)
+        server.shutdown()
+        results.append(check("no retry on 400", code == 1 and not images and server_stats["requests"] == 8,
+                             f"exit {code}, {server_stats['requests']} requests in {elapsed:.2f}s"))
+
+        # Seeds and response cache: a repeat run makes no requests and copies the same images
+        server = start_server(latency=0.2, jitter=0)
+        home = f"{tmp}/home"
+        _, first, first_images = run_cloud(server.url, f"{tmp}/first", home=home)
+        seeds = sorted(json.loads(path.with_suffix(".json").read_text())["seed"] for path in first_images)
+        distinct = len({path.read_bytes() for path in first_images})
+        results.append(check("seeds", seeds == list(range(42, 50)) and distinct == 8,
+                             f"seeds {seeds[0]}-{seeds[-1]}, {distinct} distinct images"))
+        code, repeat, repeat_images = run_cloud(server.url, f"{tmp}/repeat", home=home)
+        server_stats = stats(server)
+        summary = json.loads(next(Path(f"{tmp}/repeat").glob("cloud_summary_*.json")).read_text())
+        same = [a.read_bytes() for a in first_images] == [b.read_bytes() for b in repeat_images]
+        results.append(check("response cache", code == 0 and same and server_stats["requests"] == 8
+                             and summary["cache"]["hits"] == 8,
+                             f"{first:.2f}s → {repeat:.2f}s, {summary['cache']['hits']} hits, "
+                             f"{server_stats['requests']} requests in total"))
+
+        # Eviction: a tiny size limit keeps only the most recent images
+        run_cloud(server.url, f"{tmp}/evict", "--seed", "100", "--cache-max-gb", "1e-6", home=home)
+        server.shutdown()
+        summary = json.loads(next(Path(f"{tmp}/evict").glob("cloud_summary_*.json")).read_text())
+        cached = len(list(Path(home, ".cache", "sd-generate", "cloud").glob("*.png")))
+        results.append(check("cache eviction", summary["cache"]["evictions"] > 0 and cached < 16,
+                             f"{summary['cache']['evictions']} evicted, {cached} images left"))
+
+    print()
+    if all(results):
+        print("✓ All checks passed")
+        return 0
+    print(f"✗ {results.count(False)} check(s) failed")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())